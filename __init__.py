@@ -2,8 +2,8 @@
 TA ComfyUI Nodes Pack
 © Thomas Möhrling (thomo.ART)
 Erstelldatum: 2026-03-02
-Änderungsdatum: 2026-03-13
-Version: v4.0 - TADiscordLink hinzugefügt
+Änderungsdatum: 2026-10-17
+Version: v4.2 - Hintergrund-Jobs für TACaptioning (/ta_captioning/jobs) hinzugefügt
 """
 
 print("\n" + "="*60)
@@ -30,6 +30,8 @@ from .ta_seedvr2_gate import TASeedVR2Gate
 from .ta_flux_guidance_gate import TAFluxGuidanceGate
 from .ta_model_presets import TAModelPreset
 from .ta_directory_captioning import TACaptioning
+from .ta_caption_export import TACaptionExport
+from . import ta_caption_jobs  # Registriert die /ta_captioning/jobs Routen
 from .ta_cleanup_switch import TACleanupSwitch
 from .ta_help_link import TAHelpLink
 from .ta_discord_link import TADiscordLink
@@ -52,6 +54,7 @@ NODE_CLASS_MAPPINGS.update({
     "TAFluxGuidanceGate":     TAFluxGuidanceGate,
     "TAModelPreset":          TAModelPreset,
     "TACaptioning":           TACaptioning,
+    "TACaptionExport":        TACaptionExport,
     "TACleanupSwitch":        TACleanupSwitch,
     "TAHelpLink":             TAHelpLink,
     "TADiscordLink":          TADiscordLink,
@@ -74,6 +77,7 @@ NODE_DISPLAY_NAME_MAPPINGS.update({
     "TAFluxGuidanceGate":     "🌊 TA Flux Guidance Gate",
     "TAModelPreset":          "🗂️ TA Model Presets",
     "TACaptioning":           "📷 TA Directory Captioning",
+    "TACaptionExport":        "📤 TA Caption Export",
     "TACleanupSwitch":        "🧹 TA Cleanup Switch",
     "TAHelpLink":             "🔗 TA Help Link",
     "TADiscordLink":          "💬 TA Discord Link",
@@ -0,0 +1,326 @@
+"""
+================================================================================
+Module      : TA LLM Benchmarks
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.0
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Offline throughput benchmark for TA Directory Captioning and TA Smart LLM.
+    Starts the stub server (stub_llm_server.py) in a separate process, so its
+    CPU use does not count, generates a synthetic image set and drives the
+    real node code through it. Reports requests/sec, p50/p99 request latency
+    (for captioning also per image, including pipeline wait) and CPU time
+    per stage (image preparation, request workers, collecting thread).
+    --json stores the results; --baseline compares them against an earlier
+    run and exits with code 1 on a throughput regression.
+
+    Run with the Python environment of ComfyUI (Pillow, requests, aiohttp;
+    torch for TA Smart LLM), e.g.:
+        python benchmarks/run_benchmarks.py --images 200 --concurrency 1,4,8 --latency 0.3
+    TA Smart LLM is pointed at the stub through a temporary backends file,
+    so both benchmarks run next to a live LM Studio or Ollama.
+================================================================================
+"""
+
+import os
+import sys
+import json
+import time
+import types
+import socket
+import asyncio
+import argparse
+import tempfile
+import importlib
+import threading
+import subprocess
+from collections import defaultdict
+
+PACK_DIR    = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_llm_server.py")
+PACK_NAME   = "ta_nodes_pack"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_llm_server import add_config_arguments  # noqa: E402
+
+
+def load_module(name: str):
+    """
+    Imports a module of the node pack without running the pack's __init__.py,
+    which registers every node and needs a running ComfyUI.
+    """
+    if PACK_NAME not in sys.modules:
+        package = types.ModuleType(PACK_NAME)
+        package.__path__ = [PACK_DIR]
+        sys.modules[PACK_NAME] = package
+    return importlib.import_module(f"{PACK_NAME}.{name}")
+
+
+# --------------------------------------------------------------------------- #
+#  Helpers                                                                    #
+# --------------------------------------------------------------------------- #
+
+class StageClock:
+    """
+    Sums the CPU time (time.thread_time) spent inside wrapped callables per stage.
+    """
+
+    def __init__(self):
+        self.cpu   = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def wrap(self, stage: str, fn):
+        def timed(*args, **kwargs):
+            started = time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.cpu[stage] += time.thread_time() - started
+        return timed
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def port_in_use(port: int) -> bool:
+    with socket.socket() as s:
+        return s.connect_ex(("127.0.0.1", port)) == 0
+
+
+def start_stub(port: int, args) -> subprocess.Popen:
+    """
+    Starts the stub server process and waits until it accepts connections.
+    """
+    cmd = [sys.executable, STUB_SCRIPT, "--port", str(port),
+           "--latency", str(args.latency), "--token-delay", str(args.token_delay),
+           "--tokens", str(args.tokens), "--slots", str(args.slots),
+           "--error-rate", str(args.error_rate), "--error-status", str(args.error_status),
+           "--drop-rate", str(args.drop_rate), "--seed", str(args.seed)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while not port_in_use(port):
+        if proc.poll() is not None or time.time() > deadline:
+            proc.kill()
+            raise RuntimeError(f"Stub server did not start on port {port}")
+        time.sleep(0.05)
+    return proc
+
+
+def make_images(directory: str, count: int, size: int):
+    """
+    Writes count synthetic PNG images (gradient plus noise, size x size).
+    """
+    from PIL import Image
+    noise = Image.effect_noise((size, size), 48).convert("RGB")
+    for i in range(count):
+        base = Image.linear_gradient("L").resize((size, size)).rotate(i * 7 % 360).convert("RGB")
+        Image.blend(base, noise, 0.3 + (i % 5) * 0.1).save(os.path.join(directory, f"bench_{i:05d}.png"))
+
+
+def summarize(name: str, latencies: list, errors: int, wall: float, cpu: dict, extra: dict = None) -> dict:
+    percentile = load_module("ta_caption_report").percentile
+    return {
+        "name":      name,
+        "requests":  len(latencies),
+        "errors":    errors,
+        "wall_s":    round(wall, 3),
+        "req_per_s": round(len(latencies) / max(wall, 1e-9), 3),
+        "p50_s":     round(percentile(latencies, 50) or 0.0, 4),
+        "p99_s":     round(percentile(latencies, 99) or 0.0, 4),
+        "cpu_s":     {k: round(v, 3) for k, v in cpu.items()},
+        **(extra or {}),
+    }
+
+
+# --------------------------------------------------------------------------- #
+#  Benchmarks                                                                 #
+# --------------------------------------------------------------------------- #
+
+def bench_captioning(args, image_dir: str) -> list:
+    cap     = load_module("ta_directory_captioning")
+    backend = "LMStudio" if args.backend == "lmstudio" else "Ollama"
+    port    = free_port()
+    proc    = start_stub(port, args)
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            node  = cap.TACaptioning()
+            clock = StageClock()
+            original_prepare   = cap.prepare_image
+            cap.prepare_image  = clock.wrap("prepare", original_prepare)
+            node._send_with_retry = clock.wrap("request", node._send_with_retry)
+
+            report  = os.path.join(tempfile.gettempdir(), f"ta_bench_report_{os.getpid()}.json")
+            wall    = time.perf_counter()
+            cpu     = time.process_time()
+            main    = time.thread_time()
+            try:
+                node.caption_directory(
+                    image_dir, f"{backend}/stub-vision-vl-7b", f"http://127.0.0.1:{port}",
+                    "Describe the image.", "You are a captioning model.", 0.2, args.tokens,
+                    args.max_image_size, True,
+                    max_concurrency=concurrency, prefetch_images=max(4, concurrency * 2),
+                    payload_format=args.payload_format, stream_responses=args.stream,
+                    max_retries=args.max_retries, report_path=report, use_cache=False,
+                    adaptive_concurrency=args.adaptive,
+                )
+            finally:
+                cap.prepare_image = original_prepare
+            clock.cpu["collect"] = time.thread_time() - main
+            clock.cpu["process"] = time.process_time() - cpu
+            wall = time.perf_counter() - wall
+
+            with open(report, "r", encoding="utf-8") as f:
+                rows = json.load(f)["images"]
+            os.remove(report)
+            done      = [r for r in rows if r["status"] == "done" and r["request_s"] is not None]
+            latencies = [r["request_s"] for r in done]
+            per_image = [r["total_s"] for r in done]
+            errors    = sum(1 for r in rows if r["status"] == "error")
+            percentile = load_module("ta_caption_report").percentile
+            results.append(summarize(f"captioning c={concurrency}", latencies, errors, wall, clock.cpu, {
+                "stream":      args.stream,
+                "image_p50_s": round(percentile(per_image, 50) or 0.0, 4),
+                "image_p99_s": round(percentile(per_image, 99) or 0.0, 4),
+            }))
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+def bench_smart_llm(args) -> list:
+    try:
+        smart = load_module("ta_smart_llm")
+    except ImportError as e:
+        print(f"[TA Bench] TA Smart LLM not importable ({e}) – skipping.")
+        return []
+    backend = "LMStudio" if args.backend == "lmstudio" else "Ollama"
+    port    = free_port()
+    workdir = tempfile.mkdtemp(prefix="ta_bench_llm_")
+    backends_file = os.path.join(workdir, "backends.json")
+    with open(backends_file, "w", encoding="utf-8") as f:
+        json.dump([{"name": backend, "type": args.backend, "urls": [f"http://127.0.0.1:{port}"]}], f)
+    smart.MODEL_REGISTRY = smart.ModelRegistry(os.path.join(workdir, "models.json"),
+                                               backends_file=backends_file)
+
+    proc    = start_stub(port, args)
+    node    = smart.TASmartLLM()
+    results = []
+
+    async def timed_generate(latencies, errors):
+        started = time.perf_counter()
+        prompt, status, _ = await node.generate(
+            True, f"{backend}/stub-text-7b", "Write a prompt.", "You are a prompt generator.",
+            max_tokens=max(64, args.tokens), unload_image_models_first=False, unload_llm_after=False,
+        )
+        if prompt and not prompt.startswith("ERROR"):
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(status)
+
+    async def run(parallel):
+        latencies, errors = [], []
+        for start in range(0, args.llm_requests, parallel):
+            batch = min(parallel, args.llm_requests - start)
+            await asyncio.gather(*(timed_generate(latencies, errors) for _ in range(batch)))
+        return latencies, errors
+
+    try:
+        for parallel in sorted({1, args.llm_parallel}):
+            wall = time.perf_counter()
+            cpu  = time.process_time()
+            latencies, errors = asyncio.run(run(parallel))
+            results.append(summarize(f"smart_llm parallel={parallel}", latencies, len(errors),
+                                     time.perf_counter() - wall, {"process": time.process_time() - cpu}))
+    finally:
+        proc.terminate()
+        proc.wait()
+    return results
+
+
+# --------------------------------------------------------------------------- #
+#  Reporting                                                                  #
+# --------------------------------------------------------------------------- #
+
+def print_table(results: list):
+    print()
+    print(f"{'benchmark':<26}{'req':>6}{'err':>5}{'req/s':>9}{'p50 s':>9}{'p99 s':>9}  cpu s")
+    for r in results:
+        cpu = ", ".join(f"{k} {v:.2f}" for k, v in r["cpu_s"].items())
+        print(f"{r['name']:<26}{r['requests']:>6}{r['errors']:>5}{r['req_per_s']:>9.2f}"
+              f"{r['p50_s']:>9.3f}{r['p99_s']:>9.3f}  {cpu}")
+    print()
+
+
+def compare(results: list, baseline_path: str, max_regression: float) -> bool:
+    """
+    Returns False if any benchmark lost more than max_regression of its
+    baseline throughput.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+    ok = True
+    for r in results:
+        base = baseline.get(r["name"])
+        if not base or not base["req_per_s"]:
+            continue
+        change = r["req_per_s"] / base["req_per_s"] - 1
+        flag   = "REGRESSION" if change < -max_regression else "ok"
+        print(f"[TA Bench] {r['name']}: {base['req_per_s']:.2f} -> {r['req_per_s']:.2f} req/s ({change:+.1%}) {flag}")
+        ok = ok and flag == "ok"
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline LLM/captioning benchmark against a stub server.")
+    parser.add_argument("--backend", choices=["lmstudio", "ollama"], default="lmstudio")
+    parser.add_argument("--images", type=int, default=100, help="Synthetic images for the captioning benchmark.")
+    parser.add_argument("--image-size", type=int, default=768)
+    parser.add_argument("--max-image-size", type=int, default=512)
+    parser.add_argument("--payload-format", choices=["PNG", "JPEG", "WEBP"], default="JPEG")
+    parser.add_argument("--concurrency", default="1,4", help="Comma-separated max_concurrency values.")
+    parser.add_argument("--adaptive", action="store_true", help="Use adaptive (AIMD) concurrency.")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Disable streaming responses.")
+    parser.add_argument("--max-retries", type=int, default=2)
+    parser.add_argument("--llm-requests", type=int, default=20, help="TA Smart LLM requests per run, 0 = skip.")
+    parser.add_argument("--llm-parallel", type=int, default=4, help="Concurrent TA Smart LLM coroutines.")
+    parser.add_argument("--skip-captioning", action="store_true")
+    parser.add_argument("--json", help="Write the results to this file.")
+    parser.add_argument("--baseline", help="Results file of an earlier run to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed throughput loss against the baseline (0.2 = 20%%).")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    args.concurrency = [max(1, int(c)) for c in args.concurrency.split(",") if c.strip()]
+
+    results = []
+    if not args.skip_captioning and args.images > 0:
+        with tempfile.TemporaryDirectory(prefix="ta_bench_") as image_dir:
+            print(f"[TA Bench] Generating {args.images} images ({args.image_size}px)...")
+            make_images(image_dir, args.images, args.image_size)
+            results += bench_captioning(args, image_dir)
+    if args.llm_requests > 0:
+        results += bench_smart_llm(args)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"), "args": vars(args), "results": results},
+                      f, indent=2)
+        print(f"[TA Bench] Results written to {args.json}")
+    if args.baseline and not compare(results, args.baseline, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+================================================================================
+Module      : TA Stub LLM Server
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.0
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Local stand-in for LM Studio and Ollama used by the benchmarks. Speaks
+    /v1/models, /v1/chat/completions (JSON or SSE stream), /api/tags,
+    /api/generate (JSON or NDJSON stream) and the unload calls of both
+    (/api/v1/models/unload, keep_alive=0) with configurable time to first
+    token, per-token delay, parallel slots and error injection (HTTP errors
+    with Retry-After, dropped connections). Needs only the standard library,
+    so it runs in CI without network or GPU.
+
+    Standalone: python stub_llm_server.py --port 1234 --latency 0.2
+================================================================================
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_MODELS = ["stub-vision-vl-7b", "stub-text-7b"]
+
+
+class StubConfig:
+    """
+    Behaviour of the stub server.
+
+    Args:
+        latency (float):     Seconds until the first token.
+        token_delay (float): Seconds per generated token.
+        tokens (int):        Tokens per answer (capped by max_tokens/num_predict).
+        slots (int):         Requests processed in parallel; more wait in a queue
+                             like on a real server. 0 = unlimited.
+        error_rate (float):  Share of requests answered with error_status.
+        error_status (int):  HTTP status of injected errors.
+        drop_rate (float):   Share of requests whose connection is closed without answer.
+        seed (int):          Random seed for reproducible error injection.
+    """
+
+    def __init__(self, latency=0.2, token_delay=0.0, tokens=40, slots=0,
+                 error_rate=0.0, error_status=503, drop_rate=0.0, seed=1):
+        self.latency      = latency
+        self.token_delay  = token_delay
+        self.tokens       = tokens
+        self.slots        = slots
+        self.error_rate   = error_rate
+        self.error_status = error_status
+        self.drop_rate    = drop_rate
+        self.rng          = random.Random(seed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version   = "TAStubLLM/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    # --- helpers ------------------------------------------------------- #
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw    = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    def _inject(self) -> bool:
+        """
+        Applies error injection. Returns True if the request was consumed.
+        """
+        config = self.server.config
+        with self.server.lock:
+            roll = config.rng.random()
+        if roll < config.drop_rate:
+            self.close_connection = True
+            self.connection.close()
+            return True
+        if roll < config.drop_rate + config.error_rate:
+            self._send_json(config.error_status, {"error": "injected error"}, {"Retry-After": "0"})
+            return True
+        return False
+
+    # --- routes -------------------------------------------------------- #
+
+    def do_GET(self):
+        if self.path.startswith("/v1/models"):
+            self._send_json(200, {"data": [{"id": m} for m in STUB_MODELS]})
+        elif self.path.startswith("/api/tags"):
+            self._send_json(200, {"models": [{"name": m} for m in STUB_MODELS]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path.startswith("/api/v1/models/unload"):
+            self._send_json(200, {"instance_id": payload.get("instance_id")})  # LM Studio unload
+            return
+        if self.path.startswith("/v1/chat/completions"):
+            limit  = payload.get("max_tokens")
+            stream = self._stream_lmstudio
+            answer = self._answer_lmstudio
+        elif self.path.startswith("/api/generate") or self.path.startswith("/api/chat"):
+            limit  = (payload.get("options") or {}).get("num_predict")
+            stream = self._stream_ollama
+            answer = self._answer_ollama
+        else:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        if "prompt" not in payload and "messages" not in payload:
+            self._send_json(200, {"done": True})  # Ollama unload call (keep_alive=0)
+            return
+
+        self.server.enter()
+        try:
+            if self._inject():
+                return
+            config = self.server.config
+            tokens = min(config.tokens, int(limit or config.tokens))
+            time.sleep(config.latency)
+            if payload.get("stream"):
+                stream(tokens, config.token_delay)
+            else:
+                time.sleep(tokens * config.token_delay)
+                answer(tokens)
+        finally:
+            self.server.leave()
+
+    def _answer_lmstudio(self, tokens):
+        self._send_json(200, {
+            "choices": [{"message": {"role": "assistant", "content": "tok " * tokens}, "finish_reason": "stop"}],
+            "usage":   {"prompt_tokens": 50, "completion_tokens": tokens},
+        })
+
+    def _answer_ollama(self, tokens):
+        self._send_json(200, {
+            "response": "tok " * tokens, "message": {"content": "tok " * tokens}, "done": True,
+            "prompt_eval_count": 50, "eval_count": tokens,
+            "eval_duration": int(tokens * self.server.config.token_delay * 1e9),
+        })
+
+    def _start_stream(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_lmstudio(self, tokens, token_delay):
+        self._start_stream("text/event-stream")
+        for _ in range(tokens):
+            chunk = {"choices": [{"delta": {"content": "tok "}}]}
+            self._chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            time.sleep(token_delay)
+        usage = {"choices": [], "usage": {"prompt_tokens": 50, "completion_tokens": tokens}}
+        self._chunk(f"data: {json.dumps(usage)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self._chunk(b"")
+
+    def _stream_ollama(self, tokens, token_delay):
+        self._start_stream("application/x-ndjson")
+        for _ in range(tokens):
+            self._chunk((json.dumps({"response": "tok ", "message": {"content": "tok "}, "done": False}) + "\n").encode("utf-8"))
+            time.sleep(token_delay)
+        final = {"response": "", "done": True, "prompt_eval_count": 50, "eval_count": tokens,
+                 "eval_duration": int(tokens * token_delay * 1e9)}
+        self._chunk((json.dumps(final) + "\n").encode("utf-8"))
+        self._chunk(b"")
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with request counters.
+
+    max_active is the highest number of requests processed at once, which
+    shows whether a client really keeps its configured concurrency.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, config: StubConfig = None, host: str = "127.0.0.1"):
+        super().__init__((host, port), _Handler)
+        self.config     = config or StubConfig()
+        self.lock       = threading.Lock()
+        self.slots      = threading.Semaphore(self.config.slots) if self.config.slots else None
+        self.requests   = 0
+        self.active     = 0
+        self.max_active = 0
+
+    def handle_error(self, request, client_address):
+        # Clients closing pooled keep-alive connections are normal, not errors
+        if not isinstance(sys.exc_info()[1], (ConnectionError, TimeoutError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def enter(self):
+        with self.lock:
+            self.requests += 1
+        if self.slots is not None:
+            self.slots.acquire()
+        with self.lock:
+            self.active    += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+        if self.slots is not None:
+            self.slots.release()
+
+    def start(self):
+        """
+        Serves in a daemon thread and returns self.
+        """
+        threading.Thread(target=self.serve_forever, name="ta-stub-llm", daemon=True).start()
+        return self
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds until the first token.")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds per token.")
+    parser.add_argument("--tokens", type=int, default=40, help="Tokens per answer.")
+    parser.add_argument("--slots", type=int, default=0, help="Parallel slots, 0 = unlimited.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with --error-status.")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of requests with a dropped connection.")
+    parser.add_argument("--seed", type=int, default=1)
+
+
+def config_from_args(args) -> StubConfig:
+    return StubConfig(latency=args.latency, token_delay=args.token_delay, tokens=args.tokens,
+                      slots=args.slots, error_rate=args.error_rate, error_status=args.error_status,
+                      drop_rate=args.drop_rate, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub LM Studio / Ollama server for benchmarks.")
+    parser.add_argument("--port", type=int, default=1234)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubLLMServer(args.port, config_from_args(args))
+    print(f"[TA Stub LLM] Serving LM Studio and Ollama API on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
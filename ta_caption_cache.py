@@ -0,0 +1,154 @@
+"""
+================================================================================
+Module      : TA Caption Cache
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.1
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Persistent, content-addressed caption cache for TA Directory Captioning.
+    Captions are stored in a small SQLite database next to the node pack and
+    keyed on the SHA-256 of the image bytes plus all request parameters that
+    influence the result (model, prompts, temperature, max_tokens, ...).
+    Copied or reorganised datasets are therefore served from the cache instead
+    of being sent to the vision model again. The database is trimmed to
+    CACHE_MAX_MB by evicting the least recently used entries.
+================================================================================
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+CACHE_DB     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ta_caption_cache.sqlite")
+CACHE_MAX_MB = 256
+
+# Eviction runs after this many inserts instead of after every single one.
+_EVICT_EVERY = 200
+
+
+def image_digest(img_bytes: bytes) -> str:
+    """
+    Returns the SHA-256 hex digest of the raw image file bytes.
+    """
+    return hashlib.sha256(img_bytes).hexdigest()
+
+
+def cache_key(digest: str, params: dict) -> str:
+    """
+    Combines an image digest and the request parameters into one cache key.
+
+    Args:
+        digest (str):  SHA-256 hex digest of the image bytes.
+        params (dict): All parameters that change the caption (JSON-serialisable).
+
+    Returns:
+        str: SHA-256 hex digest identifying image + request.
+    """
+    blob = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{digest}\n{blob}".encode("utf-8")).hexdigest()
+
+
+class CaptionCache:
+    """
+    Thread-safe SQLite store for captions, keyed by cache_key().
+
+    A single connection is shared between the preparation workers (lookups)
+    and the collecting thread (inserts); all access is serialised by a lock.
+    """
+
+    def __init__(self, path: str = CACHE_DB, max_mb: float = CACHE_MAX_MB, label: str = "TA-Captioning"):
+        self.path      = path
+        self.label     = label
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock     = threading.Lock()
+        self._inserts  = 0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            " key TEXT PRIMARY KEY,"
+            " caption TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON captions(last_used)")
+        self._conn.commit()
+
+    def get(self, key: str):
+        """
+        Returns the cached caption for key, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT caption FROM captions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE captions SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key: str, caption: str):
+        """
+        Stores a caption and trims the database periodically.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO captions (key, caption, size, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, caption, len(caption.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+            self._inserts += 1
+            if self._inserts % _EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        """
+        Deletes least recently used entries until the total caption size fits
+        into max_bytes. Caller must hold the lock.
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM captions").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess  = total - self.max_bytes
+        doomed  = []
+        for key, size in self._conn.execute("SELECT key, size FROM captions ORDER BY last_used ASC"):
+            doomed.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+        self._conn.executemany("DELETE FROM captions WHERE key = ?", doomed)
+        self._conn.commit()
+        print(f"[{self.label}] Cache: evicted {len(doomed)} old entries.")
+
+
+_shared_cache = None
+_shared_lock  = threading.Lock()
+
+
+def get_caption_cache() -> CaptionCache:
+    """
+    Returns the process-wide CaptionCache instance, opening it on first use.
+    """
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = CaptionCache()
+        return _shared_cache
@@ -0,0 +1,104 @@
+"""
+================================================================================
+Module      : TA Caption Dedupe
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.0
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Near-duplicate detection for TA Directory Captioning. Computes a 64-bit
+    difference hash (dHash) per image in a thread pool and groups images
+    whose hashes differ in at most a given number of bits. Seed sweeps,
+    re-encodes and upscaled copies of the same frame end up in one group, so
+    only its first image has to be sent to the vision model.
+================================================================================
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8  # 8x8 gradient bits = 64-bit hash
+
+# Per-byte popcount table for NumPy versions without np.bitwise_count().
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def dhash(image_path: str, hash_size: int = HASH_SIZE):
+    """
+    Returns the difference hash of an image as int, or None if it cannot be read.
+
+    The image is reduced to (hash_size + 1) x hash_size grey pixels; every bit
+    says whether a pixel is brighter than its right neighbour. JPEGs are
+    decoded at reduced size via draft(), which makes hashing much cheaper
+    than a full decode.
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.draft("L", (hash_size * 8, hash_size * 8))
+            small = img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+            pixels = np.asarray(small, dtype=np.int16)
+    except Exception:
+        return None
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def compute_hashes(image_paths: list, workers: int = 4) -> list:
+    """
+    Hashes all images in parallel (PIL releases the GIL while decoding).
+
+    Returns:
+        list: One int hash per path, None for unreadable images.
+    """
+    if not image_paths:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ta-captioning-hash") as pool:
+        return list(pool.map(dhash, image_paths))
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT8[values.view(np.uint8)].reshape(len(values), -1).sum(axis=1)
+
+
+def group_near_duplicates(hashes: list, threshold: int) -> list:
+    """
+    Assigns every image to a representative.
+
+    Images are visited in order; each one is compared against all
+    representatives found so far in one vectorised XOR/popcount step and
+    joins the closest one within threshold bits, otherwise it becomes a new
+    representative. Unreadable images (hash None) always stand alone.
+
+    Args:
+        hashes (list):   Hashes from compute_hashes().
+        threshold (int): Maximum Hamming distance (0–64) for near-duplicates.
+
+    Returns:
+        list[int]: Index of the representative for every image (its own index
+                   for representatives).
+    """
+    groups    = []
+    rep_index = []
+    rep_hash  = np.empty(len(hashes), dtype=np.uint64)
+    for i, h in enumerate(hashes):
+        if h is None:
+            groups.append(i)
+            continue
+        if rep_index:
+            distances = _popcount(rep_hash[:len(rep_index)] ^ np.uint64(h))
+            best = int(np.argmin(distances))
+            if distances[best] <= threshold:
+                groups.append(rep_index[best])
+                continue
+        rep_hash[len(rep_index)] = h
+        rep_index.append(i)
+        groups.append(i)
+    return groups
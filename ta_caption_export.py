@@ -0,0 +1,97 @@
+"""
+================================================================================
+Node Name   : TA Caption Export
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.1
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Materialises the caption manifest written by TA Directory Captioning
+    (JSONL or SQLite) as classic .txt sidecar files next to each image, for
+    trainers and tools that expect one caption file per image.
+================================================================================
+"""
+
+import os
+import time
+
+from .ta_caption_manifest import MANIFEST_DEFAULT_NAMES, export_sidecars
+
+
+class TACaptionExport:
+    """
+    Exports a caption manifest to .txt sidecar files.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "directory_path": ("STRING", {
+                    "default": "",
+                    "multiline": False,
+                    "tooltip": "Captioned image directory (manifest paths are relative to it)."
+                }),
+                "manifest_path": ("STRING", {
+                    "default": MANIFEST_DEFAULT_NAMES["jsonl manifest"],
+                    "multiline": False,
+                    "tooltip": "JSONL or SQLite manifest. Relative paths are resolved against directory_path."
+                }),
+                "overwrite_existing": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "Overwrite",
+                    "label_off": "Skip existing"
+                }),
+            },
+            "optional": {
+                "caption_extension": ("STRING", {
+                    "default": ".txt",
+                    "multiline": False,
+                    "tooltip": "Ending of the caption files. Use the prompt suffix for manifests of "
+                               "extra prompts, e.g. '_tags.txt' for captions_tags.jsonl."
+                }),
+            }
+        }
+
+    RETURN_TYPES = ("STRING",)
+    RETURN_NAMES = ("status",)
+    FUNCTION = "export"
+    CATEGORY = "TA-Nodes/LMStudio"
+    OUTPUT_NODE = True
+
+    @classmethod
+    def IS_CHANGED(cls, *args, **kwargs):
+        """Forces re-execution on every queue run by returning the current timestamp."""
+        return time.time()
+
+    def export(self, directory_path, manifest_path, overwrite_existing, caption_extension=".txt"):
+        """
+        Writes one caption file (image name + caption_extension) per manifest entry.
+
+        Returns:
+            tuple[str]: Status string, e.g. "Exported 120 captions, 3 skipped, 0 missing images."
+        """
+        path = manifest_path.strip() or MANIFEST_DEFAULT_NAMES["jsonl manifest"]
+        if not os.path.isabs(path):
+            path = os.path.join(directory_path, path)
+        if not os.path.exists(path):
+            return (f"ERROR: Manifest not found: {path}",)
+
+        try:
+            counts = export_sidecars(path, directory_path, overwrite=overwrite_existing,
+                                     extension=caption_extension.strip() or ".txt")
+        except Exception as e:
+            return (f"ERROR: Could not export {path}: {e}",)
+
+        status_msg = (f"Exported {counts['written']} captions, {counts['skipped']} skipped, "
+                      f"{counts['missing']} missing images.")
+        print(f"[TA-Captioning] {status_msg}")
+        return (status_msg,)
+
+
+NODE_CLASS_MAPPINGS         = {"TACaptionExport": TACaptionExport}
+NODE_DISPLAY_NAME_MAPPINGS  = {"TACaptionExport": "TA Caption Export"}
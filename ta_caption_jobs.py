@@ -0,0 +1,342 @@
+"""
+================================================================================
+Module      : TA Caption Jobs
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.1
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Background jobs for TA Directory Captioning. A job runs caption_directory
+    in its own thread, so the ComfyUI queue is free for image generation
+    while a dataset is being captioned. Jobs are started from the node
+    (run_in_background) or over HTTP and controlled with these routes:
+
+        GET  /ta_captioning/jobs               – list all jobs
+        POST /ta_captioning/jobs               – start a job (body: node inputs)
+        GET  /ta_captioning/jobs/{id}          – state and progress of one job
+        POST /ta_captioning/jobs/{id}/pause    – finish in-flight images, then wait
+        POST /ta_captioning/jobs/{id}/resume
+        POST /ta_captioning/jobs/{id}/cancel
+
+    Jobs started over HTTP may only write their report and manifest inside
+    directory_path (relative paths without '..').
+    Jobs live in memory only; a job stopped by a ComfyUI restart continues
+    where it left off when it is started again with resume_mode 'resume'.
+================================================================================
+"""
+
+import os
+import re
+import time
+import ntpath
+import posixpath
+import uuid
+import inspect
+import threading
+from aiohttp import web
+from server import PromptServer
+
+from .ta_directory_captioning import (TACaptioning, CaptioningCancelled, POLL_INTERVAL,
+                                      DEFAULT_PROMPT, DEFAULT_SYSTEM_PROMPT, DEFAULT_SERVER_URLS)
+
+# Finished jobs kept for GET /ta_captioning/jobs; older ones are dropped.
+MAX_FINISHED_JOBS = 20
+
+ACTIVE_STATES = ("queued", "running", "pausing", "paused", "cancelling")
+
+# Output files a job writes; confined to directory_path for HTTP-started jobs.
+OUTPUT_PATH_INPUTS = ("report_path", "manifest_path")
+
+# Defaults for the required node inputs when a job is started over HTTP.
+REQUIRED_DEFAULTS = {
+    "server_url":         DEFAULT_SERVER_URLS["lmstudio"],
+    "prompt":             DEFAULT_PROMPT,
+    "system_prompt":      DEFAULT_SYSTEM_PROMPT,
+    "temperature":        0.2,
+    "max_tokens":         150,
+    "max_image_size":     1024,
+    "overwrite_existing": False,
+}
+
+
+class CaptionJob:
+    """
+    One background captioning run.
+
+    The worker thread calls update() with its counters, wait_while_paused()
+    between images and checks cancelled; the HTTP routes only flip flags.
+
+    States: queued -> running <-> pausing/paused -> done | cancelled | error
+    (cancelling while the outstanding requests are being aborted).
+    """
+
+    def __init__(self, params: dict):
+        self.id       = uuid.uuid4().hex[:12]
+        self.params   = params
+        self.state    = "queued"
+        self.created  = time.time()
+        self.started  = None
+        self.finished = None
+        self.status   = ""
+        self.error    = None
+        self.progress = {}
+        self._lock    = threading.Lock()
+        self._resume  = threading.Event()
+        self._cancel  = threading.Event()
+        self._resume.set()
+
+    @property
+    def directory(self) -> str:
+        return os.path.normcase(os.path.abspath(self.params["directory_path"]))
+
+    @property
+    def active(self) -> bool:
+        return self.state in ACTIVE_STATES
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    @property
+    def pause_requested(self) -> bool:
+        return not self._resume.is_set()
+
+    def update(self, **progress):
+        with self._lock:
+            self.progress.update(progress)
+
+    def pause(self) -> bool:
+        with self._lock:
+            if self.state not in ("queued", "running"):
+                return False
+            self._resume.clear()
+            self.state = "pausing"
+            return True
+
+    def resume(self) -> bool:
+        with self._lock:
+            if self.state not in ("pausing", "paused"):
+                return False
+            self._resume.set()
+            self.state = "running"
+            return True
+
+    def cancel(self) -> bool:
+        with self._lock:
+            if not self.active:
+                return False
+            self._cancel.set()
+            self._resume.set()  # Wake a paused worker so it can stop
+            self.state = "cancelling"
+            return True
+
+    def wait_while_paused(self, check):
+        """
+        Blocks the worker until the job is resumed. check() is called every
+        POLL_INTERVAL and raises once the job is cancelled.
+        """
+        with self._lock:
+            if self.state == "pausing":
+                self.state = "paused"
+        while not self._resume.wait(POLL_INTERVAL):
+            check()
+        check()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            end = self.finished or time.time()
+            return {
+                "id":        self.id,
+                "state":     self.state,
+                "directory": self.params["directory_path"],
+                "model":     self.params["model"],
+                "created":   self.created,
+                "started":   self.started,
+                "finished":  self.finished,
+                "elapsed_s": round(end - self.started, 1) if self.started else 0.0,
+                "progress":  dict(self.progress),
+                "status":    self.status,
+                "error":     self.error,
+            }
+
+    def run(self):
+        with self._lock:
+            if self.cancelled:
+                self.state, self.finished = "cancelled", time.time()
+                return
+            self.state   = "pausing" if self.pause_requested else "running"
+            self.started = time.time()
+        state, status, error = "done", "", None
+        try:
+            status = TACaptioning().caption_directory(**self.params, job=self)[0]
+        except CaptioningCancelled:
+            state, status = "cancelled", "Cancelled by user."
+        except Exception as e:
+            state, error = "error", str(e)
+            print(f"[TA-Captioning] Job {self.id} failed: {e}")
+        with self._lock:
+            self.state    = state
+            self.status   = status
+            self.error    = error
+            self.finished = time.time()
+
+
+_jobs      = {}
+_jobs_lock = threading.Lock()
+
+
+def confined_path(value: str) -> bool:
+    """
+    True if value is a relative path that cannot leave the directory it is
+    joined to (no drive, no leading slash, no '..' part) on Windows or POSIX.
+    """
+    if ntpath.isabs(value) or posixpath.isabs(value) or ntpath.splitdrive(value)[0]:
+        return False
+    return ".." not in re.split(r"[\\/]", value)
+
+
+def job_params(values: dict, confine_paths: bool = False) -> dict:
+    """
+    Completes the inputs for caption_directory with the node defaults.
+
+    With confine_paths (jobs started over HTTP) report_path and
+    manifest_path must be relative paths inside directory_path.
+
+    Raises:
+        ValueError: On unknown inputs, a missing model, a missing directory or
+                    an output path outside directory_path.
+    """
+    signature = inspect.signature(TACaptioning.caption_directory).parameters
+    allowed   = [name for name in signature if name not in ("self", "job")]
+    unknown   = sorted(set(values) - set(allowed))
+    if unknown:
+        raise ValueError(f"Unknown inputs: {', '.join(unknown)}")
+    params = {**REQUIRED_DEFAULTS, **values}
+    if not params.get("model"):
+        raise ValueError("No model given (e.g. 'LMStudio/qwen2-vl-7b').")
+    if not os.path.isdir(params.get("directory_path") or ""):
+        raise ValueError(f"Directory not found: {params.get('directory_path')}")
+    if confine_paths:
+        for name in OUTPUT_PATH_INPUTS:
+            value = str(params.get(name) or "").strip()
+            if value and not confined_path(value):
+                raise ValueError(f"{name} must be a relative path inside directory_path without '..'.")
+    return params
+
+
+def start_job(values: dict, confine_paths: bool = False) -> CaptionJob:
+    """
+    Validates the inputs (see job_params()) and starts a background job.
+
+    Raises:
+        ValueError: On invalid inputs or if another job is already captioning
+                    the same directory.
+    """
+    job = CaptionJob(job_params(values, confine_paths))
+    with _jobs_lock:
+        for other in _jobs.values():
+            if other.active and other.directory == job.directory:
+                raise ValueError(f"Job {other.id} is already captioning {job.params['directory_path']}.")
+        finished = [j for j in _jobs.values() if not j.active]
+        for old in sorted(finished, key=lambda j: j.created)[:max(0, len(finished) - MAX_FINISHED_JOBS + 1)]:
+            del _jobs[old.id]
+        _jobs[job.id] = job
+    threading.Thread(target=job.run, name=f"ta-captioning-job-{job.id}", daemon=True).start()
+    print(f"[TA-Captioning] Started background job {job.id} for {job.params['directory_path']}")
+    return job
+
+
+def get_job(job_id: str):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def list_jobs() -> list:
+    with _jobs_lock:
+        jobs = sorted(_jobs.values(), key=lambda j: j.created)
+    return [job.to_dict() for job in jobs]
+
+
+# ---------------------------------------------------------------------------
+# Web Endpoints
+# ---------------------------------------------------------------------------
+
+@PromptServer.instance.routes.get("/ta_captioning/jobs")
+async def ta_captioning_jobs_list(request):
+    """
+    Returns all known jobs, oldest first.
+
+    Route: GET /ta_captioning/jobs
+
+    Returns:
+        web.Response: JSON response with {'jobs': [...]}.
+    """
+    return web.json_response({"jobs": list_jobs()})
+
+
+@PromptServer.instance.routes.post("/ta_captioning/jobs")
+async def ta_captioning_jobs_start(request):
+    """
+    Starts a background captioning job.
+
+    Route: POST /ta_captioning/jobs
+    Body:  {'directory_path': '...', 'model': 'LMStudio/<model>', ...} – any
+           TA Directory Captioning input; missing ones use the node defaults.
+           report_path and manifest_path must stay inside directory_path.
+
+    Returns:
+        web.Response: JSON response with {'ok': True, 'job': {...}}, or
+                      {'ok': False, 'error': str} with status 400.
+    """
+    try:
+        body = await request.json()
+        if not isinstance(body, dict):
+            raise ValueError("Body must be a JSON object.")
+        job = start_job(body, confine_paths=True)
+        return web.json_response({"ok": True, "job": job.to_dict()})
+    except Exception as e:
+        return web.json_response({"ok": False, "error": str(e)}, status=400)
+
+
+@PromptServer.instance.routes.get("/ta_captioning/jobs/{job_id}")
+async def ta_captioning_jobs_get(request):
+    """
+    Returns state and progress of one job.
+
+    Route: GET /ta_captioning/jobs/{job_id}
+
+    Returns:
+        web.Response: JSON response with the job, or a 404 error.
+    """
+    job = get_job(request.match_info["job_id"])
+    if job is None:
+        return web.json_response({"error": "Job not found."}, status=404)
+    return web.json_response(job.to_dict())
+
+
+@PromptServer.instance.routes.post("/ta_captioning/jobs/{job_id}/{action}")
+async def ta_captioning_jobs_control(request):
+    """
+    Pauses, resumes or cancels a job. Pausing lets the images already sent
+    to the server finish before the job waits.
+
+    Route: POST /ta_captioning/jobs/{job_id}/pause | resume | cancel
+
+    Returns:
+        web.Response: JSON response with {'ok': bool, 'job': {...}}; 404 for an
+                      unknown job or action, 409 if the job is not in a state
+                      that allows the action.
+    """
+    job    = get_job(request.match_info["job_id"])
+    action = request.match_info["action"]
+    if job is None or action not in ("pause", "resume", "cancel"):
+        return web.json_response({"ok": False, "error": "Job or action not found."}, status=404)
+    if not getattr(job, action)():
+        return web.json_response({"ok": False, "error": f"Cannot {action} a {job.state} job.",
+                                  "job": job.to_dict()}, status=409)
+    print(f"[TA-Captioning] Job {job.id}: {action}")
+    return web.json_response({"ok": True, "job": job.to_dict()})
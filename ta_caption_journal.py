@@ -0,0 +1,114 @@
+"""
+================================================================================
+Module      : TA Caption Journal
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.1
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Append-only run journal for TA Directory Captioning. One JSON line per
+    processed image (status, duration, error, attempt) is appended to
+    .ta_captioning_journal.jsonl inside the captioned directory. A restarted
+    run reads the journal back and resumes exactly where the previous run
+    stopped, or retries only the images that failed.
+================================================================================
+"""
+
+import os
+import json
+import time
+import hashlib
+
+JOURNAL_FILENAME = ".ta_captioning_journal.jsonl"
+
+
+def run_signature(params: dict) -> str:
+    """
+    Short hash of the request parameters. Journal entries are only reused by a
+    later run with the same signature (same model, prompts, settings).
+    """
+    blob = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+
+class CaptionJournal:
+    """
+    Per-directory JSONL journal of captioning results.
+
+    Only the latest entry per image path with a matching run signature is kept
+    in memory. All writes happen on the collecting thread of the node, so no
+    locking is needed.
+    """
+
+    def __init__(self, directory: str, signature: str):
+        self.path      = os.path.join(directory, JOURNAL_FILENAME)
+        self.signature = signature
+        self.entries   = {}
+        self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Truncated last line after a crash
+                if entry.get("sig") == self.signature and "path" in entry:
+                    self.entries[entry["path"]] = entry
+
+    def status(self, rel_path: str):
+        """
+        Returns the last recorded status ('done' / 'error') for rel_path, or None.
+        """
+        entry = self.entries.get(rel_path)
+        return entry["status"] if entry else None
+
+    def entry(self, rel_path: str) -> dict:
+        """
+        Returns the last recorded entry for rel_path, or an empty dict.
+        """
+        return self.entries.get(rel_path, {})
+
+    def attempts(self, rel_path: str) -> int:
+        """
+        Returns how many runs have already tried rel_path.
+        """
+        entry = self.entries.get(rel_path)
+        return entry.get("attempt", 0) if entry else 0
+
+    def counts(self) -> dict:
+        """
+        Returns the number of journal entries per status, e.g. {'done': 120, 'error': 3}.
+        """
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def record(self, rel_path: str, status: str, duration: float, error: str = None, **extra):
+        """
+        Appends one result line and flushes it, so it survives a ComfyUI restart.
+        """
+        entry = {
+            "path":     rel_path,
+            "status":   status,
+            "duration": round(duration, 3),
+            "error":    error,
+            "attempt":  self.attempts(rel_path) + 1,
+            "sig":      self.signature,
+            "ts":       round(time.time(), 3),
+            **extra,
+        }
+        self.entries[rel_path] = entry
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,373 @@
+"""
+================================================================================
+Module      : TA Caption Manifest
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.1
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Consolidated caption output for TA Directory Captioning. Instead of one
+    small .txt file per image, captions are appended to a single JSONL file or
+    SQLite database in the captioned directory. Writes are buffered and
+    flushed in batches, so large datasets on network shares no longer pay one
+    file create per image. export_sidecars() materialises the classic .txt
+    files next to the images on demand.
+
+    The classic .txt output goes through SidecarWriter, which writes every
+    caption to a temp file and renames it into place only after a batched
+    fsync, so a crash never leaves a truncated caption behind.
+    caption_file_problem() detects empty or damaged captions from earlier
+    versions or interrupted copies.
+================================================================================
+"""
+
+import os
+import json
+import time
+import sqlite3
+
+# Output modes of TA Directory Captioning ('txt sidecars' uses SidecarWriter).
+OUTPUT_MODES = ["txt sidecars", "jsonl manifest", "sqlite manifest"]
+
+MANIFEST_DEFAULT_NAMES = {
+    "jsonl manifest":  "captions.jsonl",
+    "sqlite manifest": "captions.sqlite",
+}
+
+# A batch is flushed (and fsynced) after this many captions or seconds, whichever comes first.
+MANIFEST_FLUSH_EVERY   = 100
+MANIFEST_FLUSH_SECONDS = 5.0
+
+_SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+
+def is_sqlite_manifest(path: str) -> bool:
+    return path.lower().endswith(_SQLITE_EXTENSIONS)
+
+
+class _BufferedManifest:
+    """
+    Shared batching logic. Subclasses implement _load(), _write(batch) and
+    _read(rel_path).
+
+    All calls happen on the collecting thread of the node, so no locking is
+    needed. Paths are relative to the captioned directory with '/' separators.
+    """
+
+    def __init__(self, path: str, flush_every: int = MANIFEST_FLUSH_EVERY,
+                 flush_seconds: float = MANIFEST_FLUSH_SECONDS):
+        self.path          = path
+        self.flush_every   = max(1, int(flush_every))
+        self.flush_seconds = flush_seconds
+        self.paths         = set()
+        self._batch        = []
+        self._last_flush   = time.time()
+        self._load()
+
+    def __contains__(self, rel_path: str) -> bool:
+        return rel_path in self.paths
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, rel_path: str, caption: str, **meta):
+        """
+        Buffers one caption. Later entries for the same path replace earlier ones.
+        """
+        self.paths.add(rel_path)
+        self._batch.append({"path": rel_path, "caption": caption, "ts": round(time.time(), 3), **meta})
+        if len(self._batch) >= self.flush_every or time.time() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def get(self, rel_path: str):
+        """
+        Returns the latest caption of rel_path, buffered or written, or None.
+        """
+        for entry in reversed(self._batch):
+            if entry["path"] == rel_path:
+                return entry["caption"]
+        return self._read(rel_path)
+
+    def flush(self):
+        """
+        Writes all buffered captions in one batch.
+        """
+        if self._batch:
+            self._write(self._batch)
+            self._batch = []
+        self._last_flush = time.time()
+
+    def close(self):
+        self.flush()
+
+
+class JsonlManifest(_BufferedManifest):
+    """
+    Append-only JSONL manifest, one {"path", "caption", ...} object per line.
+    """
+
+    def _load(self):
+        self._captions = None  # Read on the first _read(), then kept up to date
+        for entry in _iter_jsonl(self.path):
+            self.paths.add(entry["path"])
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _read(self, rel_path):
+        if self._captions is None:
+            self._captions = {e["path"]: e["caption"] for e in _iter_jsonl(self.path)}
+        return self._captions.get(rel_path)
+
+    def _write(self, batch):
+        self._file.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if self._captions is not None:
+            self._captions.update((e["path"], e["caption"]) for e in batch)
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class SqliteManifest(_BufferedManifest):
+    """
+    SQLite manifest with one row per image path; a batch is one transaction.
+    """
+
+    def _load(self):
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS captions ("
+            " path TEXT PRIMARY KEY,"
+            " caption TEXT NOT NULL,"
+            " meta TEXT,"
+            " ts REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.paths.update(row[0] for row in self._conn.execute("SELECT path FROM captions"))
+
+    def _read(self, rel_path):
+        row = self._conn.execute("SELECT caption FROM captions WHERE path = ?", (rel_path,)).fetchone()
+        return row[0] if row else None
+
+    def _write(self, batch):
+        rows = []
+        for e in batch:
+            meta = {k: v for k, v in e.items() if k not in ("path", "caption", "ts")}
+            rows.append((e["path"], e["caption"], json.dumps(meta, ensure_ascii=False), e["ts"]))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO captions (path, caption, meta, ts) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def close(self):
+        super().close()
+        self._conn.close()
+
+
+class SidecarWriter(_BufferedManifest):
+    """
+    Writes one caption file per image, crash-safe and with batched fsyncs.
+
+    add() writes the caption to a hidden temp file next to the image. flush()
+    fsyncs all temp files of the batch, renames them to their final name
+    (atomic on the same filesystem) and fsyncs the touched directories. A
+    caption file is therefore either complete or absent; temp files left by
+    a crash are overwritten when the image is captioned again.
+    """
+
+    def __init__(self, root: str, extension: str = ".txt", **kwargs):
+        self.root      = root
+        self.extension = extension
+        super().__init__(root, **kwargs)
+
+    def _load(self):
+        pass  # Existence is checked on the caption files themselves
+
+    def caption_path(self, rel_path: str) -> str:
+        return sidecar_path(os.path.join(self.root, *rel_path.split("/")), self.extension)
+
+    def _read(self, rel_path):
+        try:
+            with open(self.caption_path(rel_path), "r", encoding="utf-8") as f:
+                return f.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+    def add(self, rel_path: str, caption: str, **meta):
+        final = self.caption_path(rel_path)
+        temp  = _temp_path(final)
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(caption)
+        super().add(rel_path, caption, _temp=temp, _final=final)
+
+    def _write(self, batch):
+        for e in batch:
+            with open(e["_temp"], "rb+") as f:
+                os.fsync(f.fileno())
+        folders = set()
+        for e in batch:
+            os.replace(e["_temp"], e["_final"])
+            folders.add(os.path.dirname(e["_final"]))
+        _fsync_dirs(folders)
+
+
+def sidecar_path(image_path: str, extension: str = ".txt") -> str:
+    """
+    Returns the caption file path for an image ('a/b.png' -> 'a/b.txt').
+    """
+    return os.path.splitext(image_path)[0] + extension
+
+
+def _temp_path(path: str) -> str:
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.ta-tmp")
+
+
+def _fsync_dirs(folders):
+    """
+    Makes renames durable. Directories cannot be opened on Windows, where
+    NTFS journals the rename itself.
+    """
+    if os.name == "nt":
+        return
+    for folder in folders:
+        try:
+            fd = os.open(folder, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def write_atomic(path: str, text: str):
+    """
+    Writes text to path via temp file, fsync and rename.
+    """
+    temp = _temp_path(path)
+    with open(temp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def caption_file_problem(path: str, expected_bytes: int = None, read_content: bool = True):
+    """
+    Checks an existing caption file for damage.
+
+    With expected_bytes (known from the run journal) only the file size is
+    compared, which costs a single stat; a file shorter than written is
+    truncated, a longer one was edited by hand and is kept. Otherwise, with read_content, the
+    file is read and rejected if it is blank, contains NUL bytes (typical for
+    a crash during a non-atomic write) or is not valid UTF-8 (cut inside a
+    multi-byte character).
+
+    Returns:
+        str | None: Short description of the problem, or None if the file is fine.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return "missing"
+    if size == 0:
+        return "empty"
+    if expected_bytes is not None:
+        return f"truncated ({size} of {expected_bytes} bytes)" if size < expected_bytes else None
+    if not read_content:
+        return None
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if b"\x00" in data:
+        return "contains NUL bytes"
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return "invalid UTF-8"
+    if not text.strip():
+        return "empty"
+    return None
+
+
+def open_manifest(path: str, **kwargs):
+    """
+    Opens (or creates) the manifest at path. '.sqlite', '.sqlite3' and '.db'
+    files are SQLite manifests, everything else is JSONL.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if is_sqlite_manifest(path):
+        return SqliteManifest(path, **kwargs)
+    return JsonlManifest(path, **kwargs)
+
+
+def _iter_jsonl(path: str):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Truncated last line after a crash
+            if isinstance(entry, dict) and "path" in entry and "caption" in entry:
+                yield entry
+
+
+def read_manifest(path: str) -> dict:
+    """
+    Returns {relative image path: caption} with the latest caption per image.
+
+    Raises:
+        FileNotFoundError: If the manifest does not exist.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    if is_sqlite_manifest(path):
+        conn = sqlite3.connect(path)
+        try:
+            return dict(conn.execute("SELECT path, caption FROM captions"))
+        finally:
+            conn.close()
+    return {entry["path"]: entry["caption"] for entry in _iter_jsonl(path)}
+
+
+def export_sidecars(manifest_path: str, root: str = None, overwrite: bool = False,
+                    extension: str = ".txt") -> dict:
+    """
+    Writes one caption file per manifest entry next to its image.
+
+    Args:
+        manifest_path (str): JSONL or SQLite manifest.
+        root (str):          Image directory the manifest paths are relative to
+                             (default: the manifest's directory).
+        overwrite (bool):    Replace existing caption files.
+        extension (str):     Extension of the caption files.
+
+    Returns:
+        dict: Counts {'written', 'skipped', 'missing'}; 'missing' are entries
+              whose image no longer exists.
+    """
+    root   = root or os.path.dirname(os.path.abspath(manifest_path))
+    counts = {"written": 0, "skipped": 0, "missing": 0}
+    for rel_path, caption in sorted(read_manifest(manifest_path).items()):
+        image_path = os.path.join(root, *rel_path.split("/"))
+        if not os.path.exists(image_path):
+            counts["missing"] += 1
+            continue
+        caption_path = sidecar_path(image_path, extension)
+        if not overwrite and os.path.exists(caption_path):
+            counts["skipped"] += 1
+            continue
+        write_atomic(caption_path, caption)
+        counts["written"] += 1
+    return counts
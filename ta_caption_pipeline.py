@@ -0,0 +1,632 @@
+"""
+================================================================================
+Module      : TA Caption Pipeline
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.0
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Image pipeline of TA Directory Captioning. A preparation pool reads,
+    looks up and encodes images ahead of the request stage, a request pool
+    keeps the caption requests in flight, and the calling thread collects
+    the results: it alone writes captions and updates counters, journal,
+    report and progress. Also provides the optional image sources of a run,
+    near-duplicate grouping (DuplicateGroups) and watch mode.
+================================================================================
+"""
+
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .ta_llm_client import CancelEvent
+from .ta_caption_manifest import caption_file_problem, sidecar_path
+
+# Print a progress line after this many finished images or seconds.
+PROGRESS_EVERY_IMAGES  = 25
+PROGRESS_EVERY_SECONDS = 60
+
+# How often the collecting thread wakes up to refresh the progress bar and
+# check for a ComfyUI interrupt while waiting on a request (seconds).
+POLL_INTERVAL = 0.25
+
+# Finished requests that may wait behind a slower earlier one, per request
+# slot, before dispatch stops and waits for it (bounds the reorder buffer).
+REORDER_PER_SLOT = 16
+
+
+class CaptioningCancelled(Exception):
+    """Raised inside a request worker when the run was interrupted."""
+
+
+def _interrupt_requested() -> bool:
+    """
+    Returns True if the user pressed Cancel in ComfyUI. Always False outside ComfyUI.
+    """
+    try:
+        import comfy.model_management as mm
+        return mm.processing_interrupted()
+    except Exception:
+        return False
+
+
+def _raise_interrupt():
+    """
+    Raises ComfyUI's InterruptProcessingException (and clears the flag), so the
+    execution ends as 'interrupted' instead of as an error.
+    """
+    try:
+        import comfy.model_management as mm
+    except Exception:
+        raise CaptioningCancelled("Interrupted")
+    mm.throw_exception_if_processing_interrupted()
+    raise mm.InterruptProcessingException()
+
+
+def _make_progress_bar():
+    """
+    Creates a ComfyUI progress bar for the node, or None outside ComfyUI.
+    """
+    try:
+        import comfy.utils
+        return comfy.utils.ProgressBar(1)
+    except Exception:
+        return None
+
+
+def caption_label(filename: str, task: dict) -> str:
+    """
+    Journal key and console name of one caption: the image path, plus the
+    prompt suffix for extra prompts.
+    """
+    return f"{filename} [{task['suffix']}]" if task["suffix"] else filename
+
+
+class DuplicateGroups:
+    """
+    Near-duplicate groups of the images of a run.
+
+    filter() hashes each batch of the image source (dHash, parallel), groups
+    the hashes by Hamming distance and yields the group representatives
+    first, then the other members. The pipeline captions representatives
+    and gives members a copy of their caption; a representative that is
+    skipped (journal, existing caption) passes on its existing caption.
+
+    Raises ImportError if the dedupe dependencies are missing.
+    """
+
+    def __init__(self, threshold: int, workers: int = 4):
+        from .ta_caption_dedupe import compute_hashes, group_near_duplicates
+        self._compute   = compute_hashes
+        self._group     = group_near_duplicates
+        self.threshold  = int(threshold)
+        self.workers    = workers
+        self.member_of  = {}   # member -> representative
+        self.captions   = {}   # representative -> {suffix: caption}
+        self._representatives = set()
+
+    def is_representative(self, filename: str) -> bool:
+        return filename in self._representatives
+
+    def _split(self, batch: list):
+        if not batch:
+            return
+        hashes  = self._compute([abs_path for _, abs_path in batch], self.workers)
+        groups  = self._group(hashes, self.threshold)
+        # Classify the whole batch before yielding, so a representative is
+        # known as such when it reaches the pipeline.
+        firsts, members = [], []
+        for i, item in enumerate(batch):
+            if groups[i] == i:
+                firsts.append(item)
+            else:
+                rep_path = batch[groups[i]][0]
+                self.member_of[item[0]] = rep_path
+                self._representatives.add(rep_path)
+                members.append(item)
+        print(f"[TA-Captioning] Near-duplicates: {len(members)} of {len(batch)} images "
+              f"grouped under {len(self._representatives)} representatives.")
+        yield from firsts
+        yield from members
+
+    def filter(self, source):
+        """
+        Regroups the (filename, abs_path) items of source. A None item (idle
+        watch folder) ends a batch and is passed on.
+        """
+        batch = []
+        for item in source:
+            if item is None:
+                yield from self._split(batch)
+                batch = []
+                yield None
+            else:
+                batch.append(item)
+        yield from self._split(batch)
+
+
+class CaptionPipeline:
+    """
+    One captioning run over a stream of (filename, abs_path) images.
+
+    Each task is one prompt with its own writer, cache parameters and caption
+    extension (see TACaptioning.caption_directory()). An image is prepared
+    once and requested once per task whose caption is still needed. A new
+    request goes out as soon as any running one finishes; finished results
+    wait in a reorder buffer, so captions, journal and report are still
+    written in submission order. The counters (captioned, cached,
+    duplicates, skipped, errors, total) are read by the caller for the
+    status line.
+    """
+
+    def __init__(self, tasks: list, prepare, send, model_name: str, max_in_flight: int,
+                 prefetch: int, prepare_workers: int, max_tokens: int,
+                 overwrite_existing: bool = False, validate_existing: bool = False,
+                 resume_mode: str = "off", streaming: bool = True, cache=None,
+                 journal=None, report=None, watcher=None, groups=None, job=None):
+        """
+        Args:
+            tasks (list):          Task dicts with suffix, prompt, cache_params,
+                                   extension, manifest and writer.
+            prepare (callable):    prepare(image_path, cache_params_list), returns
+                                   the tuple of prepare_image().
+            send (callable):       send(prompt, image_base64, cancel_event=, on_chunk=,
+                                   stats=), returns the caption.
+            model_name (str):      Model recorded with each caption.
+            max_in_flight (int):   Requests kept in flight over all servers.
+            prefetch (int):        Images prepared ahead of the request stage.
+            prepare_workers (int): Threads of the preparation pool.
+            max_tokens (int):      Caption length used for the streamed progress.
+            overwrite_existing (bool): Caption images that already have a caption.
+            validate_existing (bool):  Read existing captions to find damaged ones.
+            resume_mode (str):     'off', 'resume' or 'retry failed only'.
+            streaming (bool):      Requests are streamed (affects tokens/s).
+            cache (CaptionCache):  Caption cache for new captions, or None.
+            journal (CaptionJournal): Run journal, or None.
+            report (CaptionReport): Per-image report.
+            watcher (FolderIndex): Folder index in watch mode, or None.
+            groups (DuplicateGroups): Near-duplicate groups, or None.
+            job (CaptionJob):      Background job running this run, or None.
+        """
+        self.tasks              = tasks
+        self.writers            = [task["writer"] for task in tasks]
+        self.prepare            = prepare
+        self.send               = send
+        self.model_name         = model_name
+        self.max_in_flight      = max_in_flight
+        self.prefetch           = prefetch
+        self.prepare_workers    = prepare_workers
+        self.max_tokens         = max_tokens
+        self.overwrite_existing = overwrite_existing
+        self.validate_existing  = validate_existing
+        self.resume_mode        = resume_mode
+        self.streaming          = streaming
+        self.cache              = cache
+        self.journal            = journal
+        self.report             = report
+        self.watcher            = watcher
+        self.groups             = groups
+        self.job                = job
+
+        self.captioned  = 0
+        self.cached     = 0
+        self.duplicates = 0
+        self.skipped    = 0
+        self.errors     = 0
+        self.total      = 0
+
+        self.started        = time.time()
+        self._last_progress = self.started
+        self._last_reported = 0
+
+        self.cancel_event   = CancelEvent()
+        self._pbar          = _make_progress_bar() if job is None else None
+        self._pbar_updated  = 0.0
+        self._stream_chunks = {}   # caption label -> chunks received so far (written by workers)
+        self._modified      = set()  # Watch mode: images changed since they were captioned
+
+        self._prepared  = deque()  # (filename, pending tasks, started, future)
+        self._in_flight = deque()  # Reorder buffer: (filename, task, started, cache key, timings, future)
+        self._running   = set()    # Request futures that have not finished yet
+        self._reorder_limit = max_in_flight * REORDER_PER_SLOT
+        self._request_pool = None
+
+    # ------------------------------------------------------------------ #
+    #  Progress and cancellation                                           #
+    # ------------------------------------------------------------------ #
+
+    def report_progress(self, force=False):
+        finished = self.captioned + self.errors
+        now      = time.time()
+        if not force and finished - self._last_reported < PROGRESS_EVERY_IMAGES \
+                and now - self._last_progress < PROGRESS_EVERY_SECONDS:
+            return
+        rate = finished / max(now - self.started, 1e-6) * 60
+        print(f"📊 Progress: {self.captioned} captioned, {self.errors} errors, "
+              f"{self.skipped} skipped – {rate:.1f} img/min")
+        self._last_progress = now
+        self._last_reported = finished
+
+    def update_progress_bar(self, force=False):
+        now = time.time()
+        if self.job is not None and (force or now - self._pbar_updated >= POLL_INTERVAL):
+            self._pbar_updated = now
+            self.job.update(captioned=self.captioned, cached=self.cached, duplicates=self.duplicates,
+                            skipped=self.skipped, errors=self.errors, found=self.total,
+                            in_flight=len(self._running),
+                            img_per_min=round((self.captioned + self.errors)
+                                              / max(now - self.started, 1e-6) * 60, 1))
+            return
+        if self._pbar is None or self.total == 0 or (not force and now - self._pbar_updated < POLL_INTERVAL):
+            return
+        self._pbar_updated = now
+        # 100 units per image; streamed chunks fill the share of in-flight images
+        partial  = sum(min(99, n * 100 // max(1, self.max_tokens)) for n in list(self._stream_chunks.values()))
+        finished = self.captioned + self.errors + self.skipped
+        try:
+            self._pbar.update_absolute(finished * 100 + partial, self.total * len(self.tasks) * 100)
+        except Exception:
+            self.cancel_outstanding()
+            raise
+
+    def cancel_outstanding(self):
+        self.cancel_event.set()
+        for item in list(self._prepared) + list(self._in_flight):
+            item[-1].cancel()
+
+    def check_interrupt(self):
+        """
+        Raises if the job was cancelled or, outside a job, ComfyUI was interrupted.
+        """
+        if self.job is not None:
+            if self.job.cancelled:
+                print(f"🛑 Job {self.job.id} cancelled – cancelling outstanding caption requests.")
+                self.cancel_outstanding()
+                raise CaptioningCancelled("Cancelled by user")
+            return
+        if _interrupt_requested():
+            print("🛑 Interrupted – cancelling outstanding caption requests.")
+            self.cancel_outstanding()
+            _raise_interrupt()
+
+    def _wait_for(self, future):
+        self.check_interrupt()
+        while not wait([future], timeout=POLL_INTERVAL).done:
+            self.check_interrupt()
+            self.update_progress_bar()
+        return future.result()
+
+    # ------------------------------------------------------------------ #
+    #  Results                                                             #
+    # ------------------------------------------------------------------ #
+
+    def record_error(self, filename, task, started, message, timings=None):
+        print(f"❌ {message}")
+        self.errors += 1
+        if self.watcher is not None:
+            self.watcher.forget(filename)
+        if self.journal is not None:
+            self.journal.record(caption_label(filename, task), "error", time.time() - started, error=message)
+        self.report.add(path=filename, prompt=task["suffix"], status="error", cached=False, error=message,
+                        total_s=time.time() - started, **(timings or {}))
+        self.report_progress()
+        self.update_progress_bar()
+
+    def write_caption(self, filename, task, caption, started, from_cache=False, timings=None,
+                      duplicate_of=None):
+        label = caption_label(filename, task)
+        extra = {"duplicate_of": duplicate_of} if duplicate_of else {}
+        task["writer"].add(filename, caption, model=self.model_name, **extra)
+        if self.groups is not None and self.groups.is_representative(filename):
+            self.groups.captions.setdefault(filename, {})[task["suffix"]] = caption
+
+        self.captioned += 1
+        if duplicate_of is not None:
+            self.duplicates += 1
+            print(f"✅ Saved caption of '{duplicate_of}' for near-duplicate '{label}'.")
+        elif from_cache:
+            self.cached += 1
+            print(f"✅ Saved cached caption for '{label}'.")
+        else:
+            print(f"✅ Saved caption for '{label}'.")
+        if self.journal is not None:
+            self.journal.record(label, "done", time.time() - started, cached=from_cache,
+                                bytes=len(caption.encode("utf-8")), **extra)
+        self.report.add(path=filename, prompt=task["suffix"], status="done", cached=from_cache,
+                        duplicate_of=duplicate_of, response_chars=len(caption),
+                        total_s=time.time() - started, **(timings or {}))
+        self.report_progress()
+        self.update_progress_bar()
+
+    def needs_caption(self, filename, image_path, task, changed) -> bool:
+        """
+        Decides whether one prompt's caption of an image has to be
+        (re)generated: checks the journal, the size of the existing caption
+        and, with validate_existing, its content.
+        """
+        label        = caption_label(filename, task)
+        manifest     = task["manifest"]
+        caption_path = sidecar_path(image_path, task["extension"])
+
+        problem = "modified" if changed else None
+        if problem is None and self.journal is not None:
+            state = self.journal.status(label)
+            if state == "done":
+                if manifest is not None:
+                    if filename not in manifest:
+                        problem = "missing"  # Still buffered when the earlier run died
+                else:
+                    problem = caption_file_problem(caption_path, self.journal.entry(label).get("bytes"),
+                                                   read_content=self.validate_existing)
+                if problem:
+                    state = "error"
+            if state == "done" or (self.resume_mode == "retry failed only" and state != "error"):
+                return False
+
+        if manifest is not None:
+            exists = filename in manifest
+        else:
+            # One stat; the content is only read with validate_existing
+            found  = caption_file_problem(caption_path,
+                                          read_content=self.validate_existing and not self.overwrite_existing)
+            exists = found != "missing"
+            if exists and problem is None:
+                problem = found
+        if problem and problem not in ("missing", "modified"):
+            print(f"🔁 '{label}': caption {problem} – re-captioning.")
+        if problem:
+            exists = False
+        if not self.overwrite_existing and exists:
+            print(f"ℹ️  '{label}' already captioned – skipping.")
+            return False
+        return True
+
+    # ------------------------------------------------------------------ #
+    #  Stages                                                              #
+    # ------------------------------------------------------------------ #
+
+    def _finish_oldest(self):
+        filename, task, started, key, timings, future = self._in_flight.popleft()
+        label = caption_label(filename, task)
+        try:
+            caption = self._wait_for(future)
+            self._running.discard(future)
+            self._stream_chunks.pop(label, None)
+            if timings.get("completion_tokens") and "tokens_per_s" not in timings:
+                generation = timings.get("request_s", 0) - (timings.get("first_byte_s", 0) if self.streaming else 0)
+                if generation > 0:
+                    timings["tokens_per_s"] = timings["completion_tokens"] / generation
+            self.write_caption(filename, task, caption, started, timings=timings)
+            if self.cache is not None and key is not None:
+                self.cache.put(key, caption)
+
+        except CaptioningCancelled:
+            raise
+        except Exception as e:
+            self._running.discard(future)
+            self._stream_chunks.pop(label, None)
+            self.record_error(filename, task, started, f"Error processing '{label}': {e}", timings)
+
+    def _collect_finished(self):
+        # Writes the finished results at the head of the reorder buffer. A
+        # slow request only holds back the writes behind it; the buffer is
+        # bounded, beyond that the slow request is waited for.
+        while self._in_flight and (self._in_flight[0][-1].done()
+                                   or len(self._in_flight) > self._reorder_limit):
+            self._finish_oldest()
+
+    def _wait_for_slot(self):
+        """
+        Blocks until fewer than max_in_flight requests are running, i.e. until
+        any of them finishes, and writes the results that are in order.
+        """
+        self._collect_finished()
+        while len(self._running) >= self.max_in_flight:
+            self.check_interrupt()
+            done, self._running = wait(self._running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if not done:
+                self.update_progress_bar()
+            self._collect_finished()
+
+    def _dispatch_oldest(self):
+        filename, pending, started, future = self._prepared.popleft()
+
+        # One prepared payload, one request per pending prompt
+        keys, cached_captions, image_base64, prepare_s = self._wait_for(future)
+        for task, key, cached_caption in zip(pending, keys, cached_captions):
+            label   = caption_label(filename, task)
+            timings = {"prepare_s": prepare_s}
+            if cached_caption is not None:
+                try:
+                    self.write_caption(filename, task, cached_caption, started,
+                                       from_cache=True, timings=timings)
+                except Exception as e:
+                    self.record_error(filename, task, started, f"Error processing '{label}': {e}", timings)
+                continue
+
+            self._wait_for_slot()
+            self._pause_if_requested()
+
+            if not image_base64:
+                self.record_error(filename, task, started, f"Could not encode '{filename}' – skipping.", timings)
+                continue
+
+            timings["payload_bytes"] = len(image_base64)
+
+            print(f"⏳ Processing: {label}...")
+
+            request = self._request_pool.submit(
+                self.send, task["prompt"], image_base64,
+                cancel_event=self.cancel_event,
+                on_chunk=lambda n, name=label: self._stream_chunks.__setitem__(name, n),
+                stats=timings
+            )
+            self._in_flight.append((filename, task, started, key, timings, request))
+            self._running.add(request)
+
+    def _finish_in_flight(self):
+        while self._in_flight:
+            self._finish_oldest()
+
+    def _finish_pipeline(self):
+        while self._prepared:
+            self._dispatch_oldest()
+        self._finish_in_flight()
+
+    def _flush_writers(self):
+        for writer in self.writers:
+            writer.flush()
+
+    def _pause_if_requested(self):
+        # Only the requests already sent are finished; prepared images stay
+        # queued and are dispatched after the resume, so a paused job sends
+        # nothing new to the server. The watch index is not saved here:
+        # images of the current poll may still be waiting in the image source.
+        if self.job is None or not self.job.pause_requested:
+            return
+        self._finish_in_flight()
+        self._flush_writers()
+        self.update_progress_bar(force=True)
+        print(f"⏸️  Job {self.job.id} paused.")
+        self.job.wait_while_paused(self.check_interrupt)
+        print(f"▶️  Job {self.job.id} resumed.")
+
+    def _drain(self):
+        # The index is only saved here, when every polled image is finished;
+        # after an interrupt the last saved state is still consistent.
+        self._finish_pipeline()
+        self._flush_writers()
+        self.watcher.save()
+        self.report_progress()
+        self.update_progress_bar(force=True)
+
+    # ------------------------------------------------------------------ #
+    #  Image sources                                                       #
+    # ------------------------------------------------------------------ #
+
+    def watch_source(self, interval: float, minutes: float = 0):
+        """
+        Yields images from the folder index: everything unknown on the first
+        (full) poll, then only changes. Yields None whenever the folder is
+        idle, so the pipeline is drained before the next sleep. Ends after
+        minutes (0 = until interrupted).
+        """
+        deadline = time.time() + minutes * 60 if minutes else None
+        full     = True
+        while True:
+            for rel_path, abs_path, changed in self.watcher.poll(full=full):
+                if changed:
+                    self._modified.add(rel_path)
+                yield (rel_path, abs_path)
+            full = False
+            yield None
+            next_poll = time.time() + interval
+            while time.time() < next_poll:
+                if deadline is not None and time.time() >= deadline:
+                    return
+                self.check_interrupt()
+                time.sleep(POLL_INTERVAL)
+
+    # ------------------------------------------------------------------ #
+    #  Run                                                                 #
+    # ------------------------------------------------------------------ #
+
+    def _copy_duplicate(self, filename, pending) -> list:
+        """
+        Writes the representative's captions for a near-duplicate member and
+        returns the tasks that still need a request of their own.
+        """
+        rep_path = self.groups.member_of.pop(filename, None)
+        if rep_path is None:
+            return pending
+        if any(item[0] == rep_path for item in list(self._prepared) + list(self._in_flight)):
+            self._finish_pipeline()  # All representatives come first; wait for them once
+        copies  = self.groups.captions.get(rep_path, {})
+        missing = []
+        for task in pending:
+            if task["suffix"] not in copies:
+                missing.append(task)  # Representative failed or has no caption – caption it here
+                continue
+            try:
+                self.write_caption(filename, task, copies[task["suffix"]], time.time(),
+                                   duplicate_of=rep_path)
+            except Exception as e:
+                self.record_error(filename, task, time.time(),
+                                  f"Error processing '{caption_label(filename, task)}': {e}")
+        return missing
+
+    def _seed_group(self, filename, skipped):
+        """
+        Keeps the existing captions of a skipped representative, so its
+        near-duplicates are copied from them instead of being requested.
+        """
+        for task in skipped:
+            caption = task["writer"].get(filename)
+            if caption and caption.strip():
+                self.groups.captions.setdefault(filename, {})[task["suffix"]] = caption
+
+    def run(self, images):
+        """
+        Captions every image yielded by images. A None item drains the
+        pipeline and saves the watch index. Raises CaptioningCancelled or
+        ComfyUI's interrupt exception after cancelling outstanding work.
+        """
+        if self.groups is not None:
+            images = self.groups.filter(images)
+        prepare_pool = ThreadPoolExecutor(max_workers=self.prepare_workers,
+                                          thread_name_prefix="ta-captioning-prepare")
+        self._request_pool = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                                thread_name_prefix="ta-captioning-request")
+        try:
+            for item in images:
+                self.check_interrupt()
+                self._pause_if_requested()
+                if item is None:
+                    self._drain()
+                    continue
+                filename, image_path = item
+                self.total += 1
+
+                changed = filename in self._modified
+                if changed:
+                    self._modified.discard(filename)
+                    print(f"🔁 '{filename}' changed – re-captioning.")
+                pending = [task for task in self.tasks
+                           if self.needs_caption(filename, image_path, task, changed)]
+                self.skipped += len(self.tasks) - len(pending)
+                if self.groups is not None and self.groups.is_representative(filename) \
+                        and len(pending) < len(self.tasks):
+                    self._seed_group(filename, [task for task in self.tasks if task not in pending])
+                if pending and self.groups is not None:
+                    pending = self._copy_duplicate(filename, pending)
+                if not pending:
+                    continue
+
+                future = prepare_pool.submit(self.prepare, image_path,
+                                             [task["cache_params"] for task in pending])
+                self._prepared.append((filename, pending, time.time(), future))
+
+                while len(self._prepared) > self.prefetch:
+                    self._dispatch_oldest()
+
+            self._finish_pipeline()
+            if self.watcher is not None:
+                self.watcher.save()
+        except BaseException:
+            # Do not join the pools: a blocking request cannot be aborted and
+            # may run for minutes. cancel_outstanding() drops every queued
+            # future (shutdown(cancel_futures=True) needs Python 3.9), running
+            # workers finish in the background and their results are discarded.
+            self.cancel_outstanding()
+            prepare_pool.shutdown(wait=False)
+            self._request_pool.shutdown(wait=False)
+            raise
+        else:
+            prepare_pool.shutdown()
+            self._request_pool.shutdown()
+        finally:
+            self._request_pool = None
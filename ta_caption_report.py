@@ -0,0 +1,132 @@
+"""
+================================================================================
+Module      : TA Caption Report
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.2
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Per-image performance report for TA Directory Captioning. Collects one
+    row of timings per image and prompt (prepare, request, first byte,
+    total), payload and response sizes and token throughput when the backend
+    reports usage.
+    Produces p50/p95 latency and throughput for the node status and can be
+    written as JSON or CSV for hardware sizing and concurrency tuning.
+================================================================================
+"""
+
+import os
+import csv
+import json
+import time
+
+REPORT_FIELDS = [
+    "path", "prompt", "status", "cached", "duplicate_of", "endpoint",
+    "prepare_s", "request_s", "first_byte_s", "total_s",
+    "payload_bytes", "response_chars",
+    "prompt_tokens", "completion_tokens", "tokens_per_s",
+    "error",
+]
+
+
+def percentile(values: list, q: float):
+    """
+    Returns the q-th percentile (0–100) of values using linear interpolation,
+    or None for an empty list.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos     = (len(ordered) - 1) * q / 100.0
+    lower   = int(pos)
+    upper   = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (pos - lower)
+
+
+class CaptionReport:
+    """
+    Collects per-image rows during a captioning run.
+
+    Rows are only kept in memory when keep_rows is set (a report file was
+    requested); latency lists for the percentiles are always collected.
+    """
+
+    def __init__(self, keep_rows: bool = False):
+        self.keep_rows  = keep_rows
+        self.rows       = []
+        self.started    = time.time()
+        self.totals     = []
+        self.requests   = []
+        self.tps        = []
+        self.requested  = 0
+
+    def add(self, **row):
+        """
+        Adds one image row. Unknown fields are ignored, missing ones stay empty.
+        """
+        row = {k: row.get(k) for k in REPORT_FIELDS}
+        for k in ("prepare_s", "request_s", "first_byte_s", "total_s", "tokens_per_s"):
+            if row[k] is not None:
+                row[k] = round(row[k], 4)
+
+        if row["status"] == "done" and not row["cached"] and not row["duplicate_of"]:
+            self.requested += 1
+            if row["total_s"] is not None:
+                self.totals.append(row["total_s"])
+            if row["request_s"] is not None:
+                self.requests.append(row["request_s"])
+            if row["tokens_per_s"]:
+                self.tps.append(row["tokens_per_s"])
+
+        if self.keep_rows:
+            self.rows.append(row)
+
+    def summary(self) -> str:
+        """
+        Returns a one-line latency/throughput summary for the status output.
+        """
+        elapsed = max(time.time() - self.started, 1e-6)
+        if not self.totals:
+            return f"{elapsed:.1f}s elapsed"
+        parts = [
+            f"latency p50 {percentile(self.totals, 50):.2f}s / p95 {percentile(self.totals, 95):.2f}s",
+            f"request p50 {percentile(self.requests, 50):.2f}s" if self.requests else None,
+            f"{self.requested / elapsed * 60:.1f} img/min",
+            f"{percentile(self.tps, 50):.1f} tok/s" if self.tps else None,
+        ]
+        return ", ".join(p for p in parts if p)
+
+    def write(self, path: str):
+        """
+        Writes the rows to path. '.csv' files get one CSV row per image, all
+        other extensions a JSON document with the summary and the rows.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.lower().endswith(".csv"):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+                writer.writeheader()
+                writer.writerows(self.rows)
+            return
+
+        elapsed = time.time() - self.started
+        document = {
+            "summary": {
+                "images":         len(self.rows),
+                "requested":      self.requested,
+                "elapsed_s":      round(elapsed, 3),
+                "img_per_min":    round(self.requested / max(elapsed, 1e-6) * 60, 3),
+                "total_p50_s":    percentile(self.totals, 50),
+                "total_p95_s":    percentile(self.totals, 95),
+                "request_p50_s":  percentile(self.requests, 50),
+                "request_p95_s":  percentile(self.requests, 95),
+                "tokens_per_s_p50": percentile(self.tps, 50),
+            },
+            "images": self.rows,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,170 @@
+"""
+================================================================================
+Module      : TA Caption Watch
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.0
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Folder index for the watch mode of TA Directory Captioning. Keeps the
+    mtime and size of every image and the mtime of every folder, persisted
+    as .ta_captioning_index.json in the watched directory. A poll stats only
+    the folders and re-lists just those whose mtime changed, so the steady-
+    state cost grows with the number of folders and changes, not with the
+    number of images. Files that are still being written are held back until
+    they have settled.
+================================================================================
+"""
+
+import os
+import json
+import time
+
+from .ta_caption_manifest import write_atomic
+
+INDEX_FILENAME = ".ta_captioning_index.json"
+INDEX_VERSION  = 1
+
+# Files modified less than this many seconds ago are still being written.
+SETTLE_SECONDS = 2.0
+
+
+class FolderIndex:
+    """
+    mtime/size index of the images below root.
+
+    poll() returns the images that are new or changed since they were last
+    reported. Folders are stored as {rel_dir: {"mtime", "subdirs", "files"}},
+    files as {name: [mtime_ns, size]}.
+
+    Args:
+        root (str):            Watched directory.
+        include_file (callable): (rel_path, name) -> True for images to watch.
+        include_dir (callable):  (rel_path, name) -> True for folders to enter.
+        max_depth (int):       Number of subfolder levels to watch.
+    """
+
+    def __init__(self, root: str, include_file, include_dir, max_depth: int = 0):
+        self.root         = root
+        self.path         = os.path.join(root, INDEX_FILENAME)
+        self.include_file = include_file
+        self.include_dir  = include_dir
+        self.max_depth    = max_depth
+        self.dirs         = {}
+        self.unsettled    = set()
+        self.dirty        = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == INDEX_VERSION and data.get("max_depth") == self.max_depth:
+            self.dirs = data.get("dirs", {})
+
+    def __len__(self):
+        return sum(len(d["files"]) for d in self.dirs.values())
+
+    def save(self):
+        """
+        Writes the index atomically if it changed since the last save.
+        """
+        if not self.dirty:
+            return
+        data = {"version": INDEX_VERSION, "max_depth": self.max_depth, "dirs": self.dirs}
+        write_atomic(self.path, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+        self.dirty = False
+
+    def forget(self, rel_path: str):
+        """
+        Drops an image from the index so the next full scan (the next run of
+        the node) reports it again. Used for images whose caption failed; the
+        running watch does not retry them on every poll.
+        """
+        rel_dir, _, name = rel_path.rpartition("/")
+        folder = self.dirs.get(rel_dir)
+        if folder is not None and folder["files"].pop(name, None) is not None:
+            self.dirty = True
+
+    def poll(self, full: bool = False) -> list:
+        """
+        Returns new or changed images as (rel_path, abs_path, modified) tuples.
+
+        Every watched folder is stat'ed once; only folders whose mtime changed
+        (or that still hold unsettled files) are listed again. With full=True
+        every folder is listed, which also picks up files rewritten in place.
+        """
+        changes = []
+        seen    = set()
+        stack   = [("", self.root, 0)]
+
+        while stack:
+            rel_dir, abs_dir, depth = stack.pop()
+            try:
+                mtime = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(rel_dir)
+
+            folder = self.dirs.get(rel_dir)
+            if full or folder is None or folder["mtime"] != mtime or rel_dir in self.unsettled:
+                folder = self._rescan(rel_dir, abs_dir, depth, mtime, changes)
+
+            for name in sorted(folder["subdirs"], reverse=True):
+                rel_path = f"{rel_dir}/{name}" if rel_dir else name
+                stack.append((rel_path, os.path.join(abs_dir, name), depth + 1))
+
+        for rel_dir in [d for d in self.dirs if d not in seen]:
+            del self.dirs[rel_dir]
+            self.dirty = True
+        return changes
+
+    def _rescan(self, rel_dir, abs_dir, depth, mtime, changes) -> dict:
+        old     = self.dirs.get(rel_dir, {"files": {}})["files"]
+        files   = {}
+        subdirs = []
+        settled = True
+        now_ns  = time.time_ns()
+        try:
+            with os.scandir(abs_dir) as entries:
+                for entry in entries:
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if depth < self.max_depth and self.include_dir(rel_path, entry.name):
+                                subdirs.append(entry.name)
+                            continue
+                        if not entry.is_file() or not self.include_file(rel_path, entry.name):
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+
+                    sig = [st.st_mtime_ns, st.st_size]
+                    if old.get(entry.name) == sig:
+                        files[entry.name] = sig
+                    elif now_ns - st.st_mtime_ns < SETTLE_SECONDS * 1e9:
+                        settled = False  # Still being written, report it on a later poll
+                        if entry.name in old:
+                            files[entry.name] = old[entry.name]
+                    else:
+                        files[entry.name] = sig
+                        changes.append((rel_path, entry.path, entry.name in old))
+        except OSError as e:
+            print(f"[TA-Captioning] Cannot read directory {abs_dir}: {e}")
+
+        if settled:
+            self.unsettled.discard(rel_dir)
+        else:
+            self.unsettled.add(rel_dir)
+        folder = {"mtime": mtime, "subdirs": sorted(subdirs), "files": files}
+        if self.dirs.get(rel_dir) != folder:
+            self.dirty = True
+        self.dirs[rel_dir] = folder
+        return folder
@@ -2,9 +2,9 @@
 ================================================================================
 Node Name   : TACleanupSwitch
 Created     : 2026-03-12
-Modified    : 2026-03-12
+Modified    : 2026-10-17
 Copyright   : © 2026, Thomas Möhrling (thomo.ART)
-Version     : 1.2
+Version     : 1.3
 --------------------------------------------------------------------------------
 Part of ComfyUI-TA-Nodes-Pack
 License     : Apache 2.0
@@ -14,7 +14,8 @@ Description:
     with a single switchable node. When enabled=False, all cleanup operations
     are skipped entirely. Passes through any input signal unchanged.
 
-    VRAM cleanup  : unload_all_models() + soft_empty_cache() +
+    VRAM cleanup  : unload_all_models() + idle local LLMs kept loaded by
+                    TA Smart LLM + soft_empty_cache() +
                     PromptServer free_memory flag + gc.collect()
     RAM cleanup   : SetSystemFileCacheSize + EmptyWorkingSet (all processes) +
                     SetProcessWorkingSetSize + retry loop with sleep
@@ -29,6 +30,7 @@ from ctypes import wintypes
 import psutil
 from server import PromptServer
 import comfy.model_management
+from .ta_llm_residency import RESIDENCY
 
 
 class AnyType(str):
@@ -82,6 +84,7 @@ class TACleanupSwitch:
         try:
             if offload_model:
                 comfy.model_management.unload_all_models()
+                RESIDENCY.unload_idle(local_only=True)
 
             if offload_cache:
                 gc.collect()
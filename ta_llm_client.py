@@ -0,0 +1,631 @@
+"""
+================================================================================
+Module      : TA LLM Client
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.5
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Shared, pooled HTTP client for all nodes that talk to LM Studio or Ollama
+    (TA Smart LLM, TA Directory Captioning). One module-level requests.Session
+    keeps connections alive between calls, limits the number of pooled
+    connections per host and applies a common connect timeout, so thousands of
+    caption requests no longer pay a fresh TCP handshake each time.
+    Also provides iterators for the streaming formats of both backends
+    (LM Studio server-sent events, Ollama NDJSON), an EndpointPool that
+    spreads requests over several servers with least-outstanding-requests
+    scheduling and passive health tracking, and an AIMD concurrency
+    controller with jittered exponential backoff that adapts the number of
+    in-flight requests to what a server can sustain. An asyncio/aiohttp
+    variant of the JSON and streaming requests serves nodes that run as
+    coroutines in ComfyUI's async execution.
+================================================================================
+"""
+
+import json
+import time
+import random
+import asyncio
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp
+except ImportError:  # Always present inside ComfyUI (server dependency)
+    aiohttp = None
+
+# Seconds to wait for the TCP connection to be established. The read timeout
+# is passed per call, because it differs widely between a 0.5 s model probe
+# and a caption request; the nodes expose it as their request_timeout input.
+CONNECT_TIMEOUT  = 3.05
+
+# Number of distinct hosts kept in the pool and keep-alive connections per host.
+# POOL_MAXSIZE should be at least the highest captioning concurrency (32).
+POOL_CONNECTIONS = 8
+POOL_MAXSIZE     = 32
+
+_session      = None
+_session_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    """
+    Creates a requests.Session with keep-alive pooling for http and https.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=False,
+        max_retries=0,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Returns the shared session, creating it on first use (thread-safe).
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def make_timeout(read_timeout):
+    """
+    Builds a (connect, read) timeout tuple. The connect part never exceeds the
+    read timeout, so short probes (e.g. 0.5 s) stay short.
+    """
+    return (min(CONNECT_TIMEOUT, read_timeout), read_timeout)
+
+
+def get(url, timeout, **kwargs) -> requests.Response:
+    """
+    GET request through the shared session. timeout is the read timeout in seconds.
+    """
+    return get_session().get(url, timeout=make_timeout(timeout), **kwargs)
+
+
+def post(url, timeout, **kwargs) -> requests.Response:
+    """
+    POST request through the shared session. timeout is the read timeout in seconds.
+    """
+    return get_session().post(url, timeout=make_timeout(timeout), **kwargs)
+
+
+class CancelEvent(threading.Event):
+    """
+    threading.Event that also closes the responses registered with track()
+    when it is set. A worker blocked on a stalled stream then fails at once
+    instead of waiting for the read timeout.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._responses = set()
+        self._lock      = threading.Lock()
+
+    def track(self, response):
+        with self._lock:
+            self._responses.add(response)
+        if self.is_set():
+            self._close_all()
+
+    def untrack(self, response):
+        with self._lock:
+            self._responses.discard(response)
+
+    def set(self):
+        super().set()
+        self._close_all()
+
+    def _close_all(self):
+        with self._lock:
+            responses = list(self._responses)
+            self._responses.clear()
+        for response in responses:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+def iter_sse_json(response):
+    """
+    Yields the JSON objects of an OpenAI-style server-sent event stream
+    (LM Studio with "stream": true). Stops at the [DONE] marker.
+    """
+    for line in response.iter_lines():
+        if not line:
+            continue
+        line = line.decode("utf-8", "replace") if isinstance(line, bytes) else line
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            yield json.loads(data)
+        except ValueError:
+            continue
+
+
+def iter_ndjson(response):
+    """
+    Yields the JSON objects of a newline-delimited JSON stream (Ollama with
+    "stream": true).
+    """
+    for line in response.iter_lines():
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+# HTTP status codes that signal an overloaded or temporarily unavailable server.
+OVERLOAD_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+def is_server_fault(status_code) -> bool:
+    """
+    True for failures that say something about the server's state (connection
+    errors and timeouts have no status code, plus OVERLOAD_STATUS_CODES). Other
+    4xx answers are caused by the request itself and must not throttle or
+    bench a healthy server.
+    """
+    return status_code is None or status_code in OVERLOAD_STATUS_CODES or status_code >= 500
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0, retry_after=None) -> float:
+    """
+    Exponential backoff with full jitter: a random delay between 0 and
+    base * 2**attempt (capped), so parallel clients do not retry in lockstep.
+    A Retry-After value sent by the server is honoured as the minimum.
+
+    Args:
+        attempt (int):       0 for the first retry, 1 for the second, ...
+        base (float):        Upper bound of the first delay in seconds.
+        cap (float):         Maximum delay in seconds.
+        retry_after:         Optional Retry-After header value (seconds).
+
+    Returns:
+        float: Delay in seconds.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    try:
+        if retry_after is not None:
+            delay = max(delay, min(cap, float(retry_after)))
+    except (TypeError, ValueError):
+        pass
+    return delay
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease limit for in-flight requests
+    to one server.
+
+    Every success with normal latency raises the limit by 1/limit (about +1
+    per round of requests) up to max_limit. An overload signal (see
+    is_server_fault()) halves it, a latency above latency_tolerance times the
+    baseline trims it by 10 %. Decreases are rate-limited to one per baseline
+    latency, so a burst of failures from the same overload counts once. The
+    baseline follows new minima immediately and rises only slowly.
+
+    The controller can be used standalone through acquire()/release(), or
+    as the limit of an endpoint inside an EndpointPool through record().
+    """
+
+    def __init__(self, max_limit: int = 8, min_limit: int = 1, initial: float = None,
+                 decrease: float = 0.5, latency_tolerance: float = 2.0):
+        self.max_limit         = max(1, int(max_limit))
+        self.min_limit         = max(1, min(int(min_limit), self.max_limit))
+        self.limit             = float(min(self.max_limit, max(self.min_limit, initial or self.min_limit)))
+        self.decrease          = decrease
+        self.latency_tolerance = latency_tolerance
+        self.baseline          = None
+        self.in_flight         = 0
+        self._last_decrease    = 0.0
+        self._cond             = threading.Condition()
+
+    @property
+    def capacity(self) -> int:
+        """Current whole number of requests allowed in flight."""
+        return max(self.min_limit, int(self.limit))
+
+    def record(self, latency: float = None, ok: bool = True, status_code=None):
+        """
+        Feeds one request outcome into the limit. Not locked; EndpointPool
+        calls it under its own lock, release() under the controller lock.
+        """
+        now = time.time()
+        if ok:
+            if latency is not None:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline += 0.05 * (latency - self.baseline)
+
+            if latency is not None and latency > self.baseline * self.latency_tolerance:
+                self._decrease(now, 0.9)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        elif is_server_fault(status_code):
+            self._decrease(now, self.decrease)
+
+    def _decrease(self, now: float, factor: float):
+        if now - self._last_decrease < max(1.0, self.baseline or 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+
+    def try_acquire(self) -> bool:
+        """
+        Takes a request slot if one is free, without waiting.
+        """
+        with self._cond:
+            if self.in_flight >= self.capacity:
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self, check=None):
+        """
+        Waits for a request slot without blocking the event loop. check() is
+        called while waiting and may raise to abort.
+        """
+        while not self.try_acquire():
+            if check is not None:
+                check()
+            await asyncio.sleep(0.05)
+
+    def acquire(self, cancel_event=None) -> bool:
+        """
+        Blocks until a request slot is free. Returns False if cancel_event was
+        set while waiting.
+        """
+        with self._cond:
+            while self.in_flight >= self.capacity:
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                self._cond.wait(0.25)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float = None, ok: bool = True, status_code=None):
+        """
+        Frees a slot taken by acquire() and records the outcome.
+        """
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.record(latency, ok, status_code)
+            self._cond.notify_all()
+
+
+# Controllers shared by all callers of the same server (see get_controller()).
+SHARED_MAX_LIMIT = 4
+
+_controllers      = {}
+_controllers_lock = threading.Lock()
+
+
+def base_url(url: str) -> str:
+    """
+    Reduces a request URL to scheme://host:port.
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_controller(url: str) -> AIMDController:
+    """
+    Returns the process-wide AIMDController for the server of url, so every
+    node talking to the same server shares one limit.
+    """
+    key = base_url(url)
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AIMDController(max_limit=SHARED_MAX_LIMIT, initial=SHARED_MAX_LIMIT)
+        return _controllers[key]
+
+
+# Consecutive failures after which an endpoint is taken out of rotation, and
+# the cooldown before it gets traffic again (doubled per further failure).
+ENDPOINT_MAX_FAILURES = 3
+ENDPOINT_COOLDOWN     = 30.0
+ENDPOINT_MAX_COOLDOWN = 300.0
+
+
+def parse_urls(text: str) -> list:
+    """
+    Splits a comma- or newline-separated list of server URLs, strips trailing
+    slashes and drops duplicates while keeping the order.
+    """
+    urls = []
+    for part in text.replace("\n", ",").split(","):
+        url = part.strip().rstrip("/")
+        if url and url not in urls:
+            urls.append(url)
+    return urls
+
+
+class Endpoint:
+    """
+    One backend server in an EndpointPool with its live counters. Its
+    outstanding requests are capped by an optional AIMDController, or else
+    by a fixed max_outstanding (None = no cap).
+    """
+
+    def __init__(self, url: str, name: str = None, controller: AIMDController = None):
+        self.url             = url.rstrip("/")
+        self.name            = name or self.url.split("://", 1)[-1]
+        self.controller      = controller
+        self.max_outstanding = None
+        self.outstanding     = 0
+        self.failures        = 0
+        self.down_until      = 0.0
+        self.ok_count        = 0
+        self.error_count     = 0
+
+    def healthy(self, now: float) -> bool:
+        return self.down_until <= now
+
+    def has_capacity(self) -> bool:
+        if self.controller is not None:
+            return self.outstanding < self.controller.capacity
+        return self.max_outstanding is None or self.outstanding < self.max_outstanding
+
+    def load(self) -> float:
+        return self.outstanding / self.controller.capacity if self.controller else self.outstanding
+
+
+class EndpointPool:
+    """
+    Thread-safe set of equivalent backend servers.
+
+    acquire() hands out the healthy endpoint with the fewest outstanding
+    requests (ties go to the endpoint listed first). release() reports the
+    outcome: after ENDPOINT_MAX_FAILURES consecutive server faults an endpoint
+    is taken out of rotation for a cooldown, after which it receives traffic
+    again and is either restored by a success or benched for longer.
+
+    max_per_endpoint caps the outstanding requests of every endpoint:
+    acquire() only hands out endpoints below their cap and blocks while all
+    healthy endpoints are saturated, so benching one server does not pile
+    its share onto the others. With adaptive=True every endpoint gets its
+    own AIMDController (up to max_per_endpoint) instead of the fixed cap,
+    and load is weighed relative to its current limit.
+    """
+
+    def __init__(self, endpoints: list, max_per_endpoint: int = None, adaptive: bool = False):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = [e if isinstance(e, Endpoint) else Endpoint(e) for e in endpoints]
+        self.adaptive  = adaptive
+        for endpoint in self.endpoints:
+            if adaptive:
+                endpoint.controller = AIMDController(max_limit=max_per_endpoint or SHARED_MAX_LIMIT)
+            elif max_per_endpoint:
+                endpoint.max_outstanding = max_per_endpoint
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, cancel_event=None, exclude=()):
+        """
+        Picks an endpoint for the next request and counts it as outstanding.
+        If every endpoint is benched, the one whose cooldown ends first is used.
+        Endpoints in exclude (e.g. the ones a retry already failed on) are only
+        used when no other endpoint is left.
+
+        Returns:
+            Endpoint, or None if cancel_event was set while waiting for capacity.
+        """
+        candidates = [e for e in self.endpoints if e not in exclude] or self.endpoints
+        with self._cond:
+            while True:
+                now     = time.time()
+                healthy = [e for e in candidates if e.healthy(now)]
+                if healthy:
+                    ready = [e for e in healthy if e.has_capacity()]
+                    if ready:
+                        endpoint = min(ready, key=lambda e: e.load())
+                        break
+                else:
+                    endpoint = min(candidates, key=lambda e: e.down_until)
+                    if endpoint.has_capacity():
+                        break
+                if cancel_event is not None and cancel_event.is_set():
+                    return None
+                self._cond.wait(0.25)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def has_capacity(self, exclude=()) -> bool:
+        """
+        True if a healthy endpoint outside exclude could take a request right
+        now, i.e. a retry can fail over at once instead of backing off.
+        """
+        now = time.time()
+        with self._cond:
+            return any(e.healthy(now) and e.has_capacity() for e in self.endpoints if e not in exclude)
+
+    def release(self, endpoint: Endpoint, ok: bool, latency: float = None, status_code=None):
+        """
+        Marks a request on endpoint as finished and updates its health and,
+        in adaptive mode, its concurrency limit.
+
+        Args:
+            endpoint (Endpoint): Endpoint returned by acquire().
+            ok (bool):           True if the request succeeded.
+            latency (float):     Observed latency in seconds (used by the AIMD limit).
+            status_code (int):   HTTP status of a failed request, None for
+                                 connection errors and timeouts.
+        """
+        with self._cond:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            if endpoint.controller is not None:
+                endpoint.controller.record(latency, ok, status_code)
+            self._cond.notify_all()
+
+            if ok:
+                endpoint.ok_count  += 1
+                endpoint.failures   = 0
+                endpoint.down_until = 0.0
+                return
+
+            endpoint.error_count += 1
+            if not is_server_fault(status_code):
+                return
+            endpoint.failures    += 1
+            if endpoint.failures >= ENDPOINT_MAX_FAILURES:
+                cooldown = min(ENDPOINT_COOLDOWN * 2 ** (endpoint.failures - ENDPOINT_MAX_FAILURES),
+                               ENDPOINT_MAX_COOLDOWN)
+                endpoint.down_until = time.time() + cooldown
+                print(f"[TA LLM Client] Endpoint {endpoint.name} failed {endpoint.failures}x – "
+                      f"out of rotation for {cooldown:.0f}s")
+
+    def summary(self) -> str:
+        """
+        Returns per-endpoint success/error counts, e.g. 'gpu1:1234 120 ok / 2 err',
+        plus the current concurrency limit in adaptive mode.
+        """
+        with self._cond:
+            return ", ".join(
+                f"{e.name} {e.ok_count} ok / {e.error_count} err"
+                + (f" (limit {e.controller.limit:.1f})" if e.controller else "")
+                for e in self.endpoints
+            )
+
+
+# --------------------------------------------------------------------------- #
+#  asyncio variant                                                            #
+# --------------------------------------------------------------------------- #
+
+class LLMRequestError(Exception):
+    """
+    A failed async request. status_code is None for connection errors and
+    timeouts; retry_after carries the server's Retry-After header.
+    """
+
+    def __init__(self, message: str, status_code: int = None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def async_session():
+    """
+    Returns a new aiohttp.ClientSession with the pool limit of the sync client.
+
+    Sessions are bound to an event loop, so callers open one per coroutine
+    run (async with llm_client.async_session() as session: ...).
+    """
+    if aiohttp is None:
+        raise RuntimeError("aiohttp is not installed")
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=POOL_MAXSIZE))
+
+
+def _client_timeout(read_timeout):
+    return aiohttp.ClientTimeout(total=None, connect=min(CONNECT_TIMEOUT, read_timeout),
+                                 sock_read=read_timeout)
+
+
+async def aget_ok(session, url: str, timeout: float) -> bool:
+    """
+    True if url answers with HTTP 200 within timeout seconds.
+    """
+    try:
+        async with session.get(url, timeout=_client_timeout(timeout)) as r:
+            return r.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False
+
+
+async def apost_json(session, url: str, payload: dict, timeout: float):
+    """
+    POSTs payload as JSON and returns the decoded JSON answer.
+
+    Raises:
+        LLMRequestError: On connection errors, timeouts or non-2xx responses.
+    """
+    try:
+        async with session.post(url, json=payload, timeout=_client_timeout(timeout)) as r:
+            if r.status >= 400:
+                raise LLMRequestError(f"HTTP Error {r.status}: {await r.text()}",
+                                      status_code=r.status, retry_after=r.headers.get("Retry-After"))
+            return await r.json(content_type=None)
+    except aiohttp.ClientConnectionError as e:
+        raise LLMRequestError(f"Connection Error: {e}")
+    except asyncio.TimeoutError:
+        raise LLMRequestError(f"Timeout: no answer within {timeout}s")
+
+
+async def apost_stream(session, url: str, payload: dict, timeout: float, stream_format: str = "sse"):
+    """
+    POSTs payload as JSON and yields the JSON objects of the streamed answer:
+    stream_format 'sse' for LM Studio server-sent events (ends at [DONE]),
+    'ndjson' for Ollama. timeout applies per read, so long generations are
+    fine as long as tokens keep arriving. Closing the generator (or
+    cancelling its consumer) closes the connection, which makes the server
+    stop generating.
+
+    Raises:
+        LLMRequestError: On connection errors, timeouts, non-2xx responses or
+                         a stream that breaks off.
+    """
+    try:
+        async with session.post(url, json=payload, timeout=_client_timeout(timeout)) as r:
+            if r.status >= 400:
+                raise LLMRequestError(f"HTTP Error {r.status}: {await r.text()}",
+                                      status_code=r.status, retry_after=r.headers.get("Retry-After"))
+            async for raw in r.content:
+                line = raw.decode("utf-8", "replace").strip()
+                if not line:
+                    continue
+                if stream_format == "sse":
+                    if not line.startswith("data:"):
+                        continue
+                    line = line[5:].strip()
+                    if line == "[DONE]":
+                        return
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+    except aiohttp.ClientError as e:
+        raise LLMRequestError(f"Connection Error: {e}")
+    except asyncio.TimeoutError:
+        raise LLMRequestError(f"Timeout: no data within {timeout}s")
+
+
+async def run_cancellable(awaitable, check, poll: float = 0.25):
+    """
+    Awaits awaitable while calling check() every poll seconds. If check()
+    raises (e.g. on a ComfyUI interrupt) the awaitable is cancelled, which
+    closes an open HTTP connection, and the exception propagates.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            check()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,241 @@
+"""
+================================================================================
+Module      : TA LLM Residency
+Created     : 2026-10-17
+Modified    : 2026-10-17
+Copyright   : © 2026, Thomas Möhrling (thomo.ART)
+Version     : 1.0
+--------------------------------------------------------------------------------
+Part of ComfyUI-TA-Nodes-Pack
+License     : Apache 2.0
+
+Description:
+    Keeps LLMs loaded in LM Studio / Ollama for an idle window after their
+    last request instead of unloading them after every call, so back-to-back
+    queued prompts reuse the warm model. A daemon thread unloads a model
+    once its window expires. Models on this machine are also unloaded early
+    when ComfyUI is about to load a model to the GPU and the free VRAM is not
+    enough (hook on comfy.model_management.load_models_gpu). Unloading uses
+    the HTTP APIs of the backends:
+
+        Ollama    : POST /api/generate        {"model": ..., "keep_alive": 0}
+        LM Studio : POST /api/v1/models/unload {"instance_id": ...}
+
+    Residents are identified by (backend type, server URL, model name).
+================================================================================
+"""
+
+import time
+import threading
+from urllib.parse import urlsplit
+
+from . import ta_llm_client as llm_client
+
+# Extra seconds added to the idle window in the keep_alive / ttl hint sent
+# with each request: the manager normally unloads first, the backend only
+# cleans up on its own if ComfyUI is gone.
+BACKEND_TTL_GRACE = 60
+
+UNLOAD_TIMEOUT = 15
+LOCAL_HOSTS    = ("127.0.0.1", "localhost", "::1", "0.0.0.0")
+
+
+def is_local(url: str) -> bool:
+    """
+    True if url points to this machine, i.e. the model shares the GPU with ComfyUI.
+    """
+    return (urlsplit(url).hostname or "").lower() in LOCAL_HOSTS
+
+
+def keep_alive_hint(kind: str, idle_seconds: int) -> dict:
+    """
+    Returns the request fields that let the backend itself unload the model
+    a little after the idle window (Ollama keep_alive, LM Studio ttl).
+    """
+    seconds = int(idle_seconds) + BACKEND_TTL_GRACE
+    if kind == "ollama":
+        return {"keep_alive": f"{seconds}s"}
+    return {"ttl": seconds}
+
+
+def unload_model(kind: str, url: str, model: str) -> bool:
+    """
+    Unloads model from the server at url via its HTTP API.
+
+    Returns:
+        bool: True if the server confirmed the unload.
+    """
+    try:
+        if kind == "ollama":
+            r = llm_client.post(f"{url}/api/generate", timeout=UNLOAD_TIMEOUT,
+                                json={"model": model, "keep_alive": 0})
+        else:
+            r = llm_client.post(f"{url}/api/v1/models/unload", timeout=UNLOAD_TIMEOUT,
+                                json={"instance_id": model})
+        if r.status_code >= 400:
+            raise RuntimeError(f"HTTP {r.status_code}: {r.text[:200]}")
+        print(f"[TA Smart LLM] Unloaded {model} on {url.split('://', 1)[-1]}")
+        return True
+    except Exception as e:
+        print(f"[TA Smart LLM] Warning: Could not unload {model} on {url}: {e}")
+        return False
+
+
+class ResidencyManager:
+    """
+    Tracks the LLMs TASmartLLM has loaded and unloads them once idle.
+
+    hold() marks the candidate servers of a request as in use, so no model
+    is unloaded while a request may still be running on it. release() ends
+    the request and starts the idle window of the server that answered; an
+    idle window of 0 unloads right away. Models in use are never unloaded.
+    """
+
+    def __init__(self):
+        self._residents = {}  # key -> {"in_use": int, "loaded": bool, "expires": float}
+        self._cond      = threading.Condition()
+        self._thread    = None
+        self._hooked    = False
+
+    def hold(self, keys: list):
+        with self._cond:
+            for key in keys:
+                entry = self._residents.setdefault(key, {"in_use": 0, "loaded": False, "expires": 0.0})
+                entry["in_use"] += 1
+
+    def release(self, keys: list, used=None, idle_seconds: float = 0):
+        """
+        Ends a request started with hold(keys).
+
+        Args:
+            keys (list):          Keys passed to hold().
+            used (tuple):         Key of the server that loaded the model, None on failure.
+            idle_seconds (float): Seconds the model stays loaded after this request.
+        """
+        unload_now = False
+        with self._cond:
+            for key in keys:
+                entry = self._residents.get(key)
+                if entry is None:
+                    continue
+                entry["in_use"] = max(0, entry["in_use"] - 1)
+                if key == used:
+                    entry["loaded"]  = True
+                    entry["expires"] = time.time() + idle_seconds
+                    unload_now = idle_seconds <= 0 and entry["in_use"] == 0
+                if not entry["loaded"] and entry["in_use"] == 0:
+                    del self._residents[key]
+            self._cond.notify_all()
+        if unload_now:
+            self._unload(self._take(lambda k, e: k == used))
+        elif used is not None:
+            self._start()
+            if is_local(used[1]):
+                self._install_vram_hook()
+
+    def resident(self) -> list:
+        """
+        Returns the loaded models as dicts with key parts and remaining idle seconds.
+        """
+        now = time.time()
+        with self._cond:
+            return [{"type": kind, "url": url, "model": model, "in_use": e["in_use"],
+                     "idle_left_s": round(max(0.0, e["expires"] - now), 1)}
+                    for (kind, url, model), e in self._residents.items() if e["loaded"]]
+
+    def _take(self, predicate) -> list:
+        """
+        Removes and returns the keys of loaded, unused models matching predicate.
+        """
+        with self._cond:
+            keys = [k for k, e in self._residents.items()
+                    if e["loaded"] and e["in_use"] == 0 and predicate(k, e)]
+            for key in keys:
+                del self._residents[key]
+            return keys
+
+    def _unload(self, keys: list):
+        for kind, url, model in keys:
+            unload_model(kind, url, model)
+
+    def unload_idle(self, local_only: bool = True) -> int:
+        """
+        Unloads every loaded model that is not in use, regardless of its idle
+        window (VRAM is needed). Returns the number of unloaded models.
+        """
+        keys = self._take(lambda k, e: not local_only or is_local(k[1]))
+        self._unload(keys)
+        return len(keys)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now     = time.time()
+                pending = [e["expires"] for e in self._residents.values() if e["loaded"] and e["in_use"] == 0]
+                wait    = min(pending) - now if pending else None
+                if wait is None or wait > 0:
+                    self._cond.wait(wait)
+                    continue
+            expired = self._take(lambda k, e: e["expires"] <= time.time())
+            self._unload(expired)
+
+    def _start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="ta-smart-llm-residency", daemon=True)
+            self._thread.start()
+
+    # ------------------------------------------------------------------ #
+    #  ComfyUI VRAM hook                                                   #
+    # ------------------------------------------------------------------ #
+
+    def make_room(self, models, memory_required=0):
+        """
+        Unloads idle local LLMs if the free VRAM is not enough for models.
+        If the need cannot be estimated on this ComfyUI version, they are
+        unloaded to be safe.
+        """
+        with self._cond:
+            if not any(e["loaded"] and e["in_use"] == 0 and is_local(k[1]) for k, e in self._residents.items()):
+                return
+        try:
+            import comfy.model_management as mm
+            device = mm.get_torch_device()
+            loaded = {id(lm.model) for lm in mm.current_loaded_models}
+            needed = memory_required + mm.minimum_inference_memory()
+            needed += sum(m.model_size() for m in models if id(m) not in loaded)
+            if mm.get_free_memory(device) >= needed:
+                return
+        except Exception:
+            pass
+        count = self.unload_idle(local_only=True)
+        if count:
+            print(f"[TA Smart LLM] Unloaded {count} idle LLM(s) to free VRAM for ComfyUI.")
+
+    def _install_vram_hook(self):
+        """
+        Wraps comfy.model_management.load_models_gpu once, so idle local LLMs
+        make room before ComfyUI loads a model to the GPU.
+        """
+        with self._cond:
+            if self._hooked:
+                return
+            self._hooked = True
+        try:
+            import comfy.model_management as mm
+        except ImportError:
+            return
+        original = mm.load_models_gpu
+
+        def load_models_gpu(models, memory_required=0, *args, **kwargs):
+            try:
+                self.make_room(models, memory_required)
+            except Exception as e:
+                print(f"[TA Smart LLM] Warning: Could not free LLM VRAM: {e}")
+            return original(models, memory_required, *args, **kwargs)
+
+        mm.load_models_gpu = load_models_gpu
+
+
+RESIDENCY = ResidencyManager()
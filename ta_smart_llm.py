@@ -2,9 +2,9 @@
 ================================================================================
 Node Name   : TA Smart LLM
 Created     : 2025
-Modified    : 2026-04-05
+Modified    : 2026-10-17
 Copyright   : © 2026, Thomas Möhrling (thomo.ART)
-Version     : 3.8
+Version     : 4.5
 --------------------------------------------------------------------------------
 Part of ComfyUI-TA-Nodes-Pack
 License     : Apache 2.0
@@ -15,20 +15,90 @@ Description:
     Auto-detects vision models (tags with [Vision]), supports image input for
     multimodal prompts, optional pre/post model unloading, and model caching.
     Returns generated prompt text and execution status.
+    generate() is a coroutine: on ComfyUI versions with async node support
+    the LLM request, retries and backoff run on the event loop without
+    blocking other work, and a ComfyUI interrupt cancels them immediately.
+    Older versions run the same coroutine through generate_blocking().
+    The model list comes from an in-memory ModelRegistry that a background
+    thread keeps up to date, so INPUT_TYPES never waits on the backends.
+    With response_cache enabled, identical requests (model, prompts,
+    sampling parameters, image) are answered from an LRU cache, optionally
+    persisted on disk, and IS_CHANGED returns the request hash so ComfyUI's
+    own node cache can skip the node on re-queues.
+    With stream_output the answer is streamed (LM Studio SSE, Ollama NDJSON)
+    and the partial text, reasoning and token count are pushed to the node
+    in the frontend (web/js/ta_smart_llm_stream.js). A ComfyUI interrupt
+    closes the stream, so the backend stops generating at once.
+    Backends are named entries in ta_smart_llm_backends.json, each with an
+    API type (lmstudio / ollama) and one or more server URLs, so the LLM can
+    run on other machines and keep the ComfyUI GPU free for diffusion. The
+    backend name is the model prefix ("GPU-Box/qwen2.5-7b"). Requests go to
+    the replicas that serve the model, with health tracking and failover
+    between them.
+    unload_llm_after no longer unloads after every call: the model stays
+    loaded for llm_idle_timeout seconds after the last request, so queued
+    prompts reuse the warm model, and is then unloaded over the backend's
+    HTTP API by the ResidencyManager (ta_llm_residency.py), earlier if
+    ComfyUI needs the VRAM.
 ================================================================================
 """
 
-import requests
 import torch
 import base64
 import json
 import os
-import subprocess
+import hashlib
 from io import BytesIO
 from PIL import Image
 import time
-
-CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ta_smart_llm_models.json")
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import ta_llm_client as llm_client
+from .ta_caption_cache import CaptionCache
+from .ta_llm_residency import RESIDENCY, keep_alive_hint
+
+# ComfyUI awaits coroutine node functions since its async node support, which
+# also introduced comfy_execution.utils. Older versions get a blocking wrapper.
+try:
+    from comfy_execution.utils import get_executing_context  # noqa: F401
+    ASYNC_NODES = True
+except ImportError:
+    ASYNC_NODES = False
+
+CACHE_FILE    = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ta_smart_llm_models.json")
+BACKENDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ta_smart_llm_backends.json")
+
+# API types: model list path and its parser, chat/generate path.
+BACKEND_TYPES = {
+    "lmstudio": ("/v1/models", lambda data: [m["id"] for m in data["data"]],     "/v1/chat/completions"),
+    "ollama":   ("/api/tags",  lambda data: [m["name"] for m in data["models"]], "/api/generate"),
+}
+
+# Written to BACKENDS_FILE on first start. Add URLs to "urls" for replicas of
+# the same models, or further entries for other machines, e.g.
+# {"name": "GPU-Box", "type": "ollama", "urls": ["http://192.168.1.20:11434"]}
+DEFAULT_BACKENDS = [
+    {"name": "LMStudio", "type": "lmstudio", "urls": ["http://127.0.0.1:1234"]},
+    {"name": "Ollama",   "type": "ollama",   "urls": ["http://127.0.0.1:11434"]},
+]
+
+# Seconds a discovered model list stays fresh; the background refresher
+# probes LM Studio and Ollama again at this interval.
+MODEL_REFRESH_SECONDS = 15.0
+
+# Response cache modes offered by the node.
+RESPONSE_CACHE_MODES  = ["off", "memory", "memory + disk"]
+RESPONSE_CACHE_SIZE   = 128   # Responses kept in memory (LRU)
+RESPONSE_CACHE_DB     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ta_smart_llm_cache.sqlite")
+RESPONSE_CACHE_MAX_MB = 64
+
+# Frontend event for streamed output and the minimum seconds between two updates.
+STREAM_EVENT          = "ta_smart_llm.stream"
+STREAM_UPDATE_SECONDS = 0.2
+STREAM_REASONING_TAIL = 2000  # Only the end of long reasoning is sent
 
 # Keywords for automatic vision model detection (lowercase)
 VISION_KEYWORDS = ["llava", "vision", "-vl-", "_vl_", "vl-", "vl_", "moondream", "minicpm-v", "internvl", "qwen-vl"]
@@ -65,6 +135,373 @@ def strip_vision_tag(model: str) -> str:
     return model.replace(" [Vision]", "")
 
 
+class Backend:
+    """
+    A named LLM backend: one API type and one or more servers (replicas)
+    that are expected to offer the same models. Every server is an
+    llm_client.Endpoint, whose failure counters persist across requests.
+    """
+
+    def __init__(self, name: str, type: str, urls: list):
+        self.name      = name
+        self.type      = type
+        self.endpoints = [llm_client.Endpoint(url) for url in urls]
+
+    @property
+    def is_lmstudio(self) -> bool:
+        return self.type == "lmstudio"
+
+    def models_url(self, endpoint) -> str:
+        return endpoint.url + BACKEND_TYPES[self.type][0]
+
+    def parse_models(self, data) -> list:
+        return BACKEND_TYPES[self.type][1](data)
+
+    def request_url(self, endpoint) -> str:
+        return endpoint.url + BACKEND_TYPES[self.type][2]
+
+
+def _parse_backend(entry) -> Backend:
+    """
+    Builds a Backend from one entry of the backends file.
+
+    Raises:
+        ValueError: If name, type or urls are missing or invalid.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError("entry must be an object")
+    name = str(entry.get("name") or "").strip()
+    kind = str(entry.get("type") or "").strip().lower()
+    urls = entry.get("urls") or entry.get("url") or []
+    urls = llm_client.parse_urls(urls if isinstance(urls, str) else ",".join(map(str, urls)))
+    if not name or "/" in name:
+        raise ValueError("'name' must be set and must not contain '/'")
+    if kind not in BACKEND_TYPES:
+        raise ValueError(f"'type' must be one of {', '.join(BACKEND_TYPES)}")
+    if not urls:
+        raise ValueError("'urls' must list at least one server URL")
+    return Backend(name, kind, urls)
+
+
+def load_backends(path: str = BACKENDS_FILE) -> list:
+    """
+    Loads the named backends from ta_smart_llm_backends.json.
+
+    Creates the file with DEFAULT_BACKENDS (local LM Studio and Ollama) if it
+    does not exist. Invalid or duplicate entries are skipped with a warning;
+    if no valid entry is left, the defaults are used.
+
+    Returns:
+        list[Backend]: Backends in file order.
+    """
+    if not os.path.exists(path):
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(DEFAULT_BACKENDS, f, indent=2, ensure_ascii=False)
+            print(f"[TA Smart LLM] {os.path.basename(path)} created with defaults.")
+        except Exception as e:
+            print(f"[TA Smart LLM] Could not create backends file: {e}")
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        entries = DEFAULT_BACKENDS
+    except Exception as e:
+        print(f"[TA Smart LLM] Error reading backends file: {e}")
+        entries = DEFAULT_BACKENDS
+
+    backends = []
+    for entry in entries if isinstance(entries, list) else []:
+        try:
+            backend = _parse_backend(entry)
+        except ValueError as e:
+            print(f"[TA Smart LLM] Skipping backend {entry!r}: {e}")
+            continue
+        if any(b.name == backend.name for b in backends):
+            print(f"[TA Smart LLM] Skipping duplicate backend name: {backend.name}")
+            continue
+        backends.append(backend)
+    return backends or [_parse_backend(entry) for entry in DEFAULT_BACKENDS]
+
+
+class ModelRegistry:
+    """
+    In-memory registry of the configured backends and the models they offer.
+
+    models() answers from memory. A daemon thread probes every server of
+    every backend every ttl seconds (earlier when a caller finds the list
+    stale) and rewrites the JSON cache only when the set of known models
+    changed. Only the very first call without any cached models probes
+    synchronously, so the dropdown is not empty after a fresh install.
+    Changes to the backends file are picked up on the next refresh.
+
+    Per backend the last reachable model list is kept: a backend that goes
+    offline keeps its models (listed after the active ones), so stored
+    workflow values stay valid. Per server the registry remembers which
+    models it served last, so requests only go to replicas that have the
+    model (see endpoints_for()).
+    """
+
+    def __init__(self, cache_file: str = CACHE_FILE, ttl: float = MODEL_REFRESH_SECONDS,
+                 backends_file: str = BACKENDS_FILE):
+        self.cache_file     = cache_file
+        self.backends_file  = backends_file
+        self.ttl            = ttl
+        self.updated        = 0.0
+        self.backends       = {}
+        self._backends_time = None
+        self._known         = {}
+        self._serving       = {}
+        self._active        = set()
+        self._saved         = None
+        self._lock          = threading.Lock()
+        self._start_lock    = threading.Lock()
+        self._wake          = threading.Event()
+        self._thread        = None
+
+    def _load_backends(self):
+        """
+        (Re)reads the backends file if it changed since the last call.
+        """
+        try:
+            mtime = os.path.getmtime(self.backends_file)
+        except OSError:
+            mtime = None
+        if self.backends and mtime == self._backends_time:
+            return
+        backends = {b.name: b for b in load_backends(self.backends_file)}
+        self._backends_time = mtime
+        with self._lock:
+            self.backends = backends
+            self._known   = {name: self._known.get(name, set()) for name in backends}
+            self._serving = {}
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                models = set(json.load(f))
+        except (OSError, ValueError, TypeError):
+            return
+        self._saved = models
+        for backend in self.backends:
+            self._known[backend] = {m for m in models if m.startswith(f"{backend}/")}
+
+    def _save(self, models: set):
+        if models == self._saved:
+            return
+        try:
+            with open(self.cache_file, "w") as f:
+                json.dump(sorted(models), f)
+        except OSError:
+            return
+        if self._saved is not None:
+            print(f"[TA Smart LLM] Model list changed: {len(models)} known models.")
+        self._saved = models
+
+    @staticmethod
+    def _probe(url, parse):
+        """
+        Returns the model names of one backend, or None if it is not reachable.
+        """
+        try:
+            r = llm_client.get(url, timeout=0.5)
+            if r.status_code == 200:
+                return set(parse(r.json()))
+        except Exception:
+            pass
+        return None
+
+    def refresh(self):
+        """
+        Probes all servers of all backends in parallel and updates the registry.
+        """
+        self._load_backends()
+        probes = [(backend, endpoint) for backend in self.backends.values() for endpoint in backend.endpoints]
+        with ThreadPoolExecutor(max_workers=max(1, len(probes)), thread_name_prefix="ta-smart-llm-probe") as pool:
+            found = list(pool.map(lambda p: self._probe(p[0].models_url(p[1]), p[0].parse_models), probes))
+        with self._lock:
+            self._active = set()
+            for (backend, endpoint), names in zip(probes, found):
+                if names is not None:
+                    self._serving[endpoint.url] = names
+            for name, backend in self.backends.items():
+                served = [found[i] for i, (b, _) in enumerate(probes) if b is backend and found[i] is not None]
+                if served:
+                    self._known[name] = {f"{name}/{model}" for model in set().union(*served)}
+                    self._active |= self._known[name]
+            self.updated = time.time()
+            known = set().union(*self._known.values())
+        self._save(known)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.ttl)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[TA Smart LLM] Model refresh failed: {e}")
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._load_backends()
+            self._load()
+            if not any(self._known.values()):
+                self.refresh()
+            self._thread = threading.Thread(target=self._run, name="ta-smart-llm-models", daemon=True)
+            self._thread.start()
+
+    def models(self) -> list:
+        """
+        Returns the tagged model list: active models first, offline ones after.
+        """
+        if self._thread is None:
+            self._start()
+        if time.time() - self.updated > self.ttl:
+            self._wake.set()
+        with self._lock:
+            known  = set().union(*self._known.values())
+            active = set(self._active)
+        result = [tag_model(m) for m in sorted(active)] + [tag_model(m) for m in sorted(known - active)]
+        return result if result else ["No Backend"]
+
+    def backend(self, name: str):
+        """
+        Returns the configured Backend called name, or None.
+        """
+        if self._thread is None:
+            self._start()
+        with self._lock:
+            return self.backends.get(name)
+
+    def endpoints_for(self, backend: Backend, model_name: str) -> list:
+        """
+        Returns the servers of backend that listed model_name on their last
+        successful probe, or all of its servers if none did.
+        """
+        with self._lock:
+            serving = [e for e in backend.endpoints if model_name in self._serving.get(e.url, ())]
+        return serving or list(backend.endpoints)
+
+
+MODEL_REGISTRY = ModelRegistry()
+
+
+def response_key(model, user_prompt, system_prompt, temperature, max_tokens, thinking_mode,
+                 image=None) -> str:
+    """
+    SHA-256 over everything that changes the LLM answer: model, prompts,
+    sampling parameters, thinking mode and the raw bytes of the image tensor.
+    """
+    params = {
+        "model":         strip_vision_tag(model),
+        "user_prompt":   user_prompt.strip(),
+        "system_prompt": system_prompt,
+        "temperature":   temperature,
+        "max_tokens":    max_tokens,
+        "thinking_mode": bool(thinking_mode),
+    }
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    if image is not None:
+        array = image.cpu().numpy()
+        digest.update(f"{array.shape}{array.dtype}".encode("ascii"))
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """
+    LRU cache of (prompt, status, reasoning) results keyed by response_key().
+
+    The memory part holds the max_entries most recently used responses. With
+    disk=True lookups fall back to, and stores also go to, a CaptionCache
+    database (RESPONSE_CACHE_DB), which survives restarts and is trimmed to
+    RESPONSE_CACHE_MAX_MB.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries    = OrderedDict()
+        self._lock       = threading.Lock()
+        self._disk       = None
+
+    def _disk_cache(self) -> CaptionCache:
+        with self._lock:
+            if self._disk is None:
+                self._disk = CaptionCache(RESPONSE_CACHE_DB, RESPONSE_CACHE_MAX_MB, label="TA Smart LLM")
+            return self._disk
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str, disk: bool = False):
+        """
+        Returns the cached result tuple for key, or None on a miss.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if not disk:
+            return None
+        raw = self._disk_cache().get(key)
+        if raw is None:
+            return None
+        value = tuple(json.loads(raw))
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: tuple, disk: bool = False):
+        self._remember(key, value)
+        if disk:
+            self._disk_cache().put(key, json.dumps(value, ensure_ascii=False))
+
+
+RESPONSE_CACHE = ResponseCache()
+
+
+def _check_interrupt():
+    """
+    Raises ComfyUI's InterruptProcessingException if the user pressed Cancel.
+    """
+    try:
+        import comfy.model_management as mm
+    except ImportError:
+        return
+    mm.throw_exception_if_processing_interrupted()
+
+
+def _is_interrupt(exc: BaseException) -> bool:
+    return type(exc).__name__ == "InterruptProcessingException"
+
+
+def _send_stream_update(node_id, text: str, reasoning: str, tokens: int, done: bool = False):
+    """
+    Pushes the partial answer to the node in the frontend. No-op outside ComfyUI.
+    """
+    if node_id is None:
+        return
+    try:
+        from server import PromptServer
+        server = PromptServer.instance
+        server.send_sync(STREAM_EVENT, {
+            "node":      node_id,
+            "text":      text,
+            "reasoning": reasoning[-STREAM_REASONING_TAIL:],
+            "tokens":    tokens,
+            "done":      done,
+        }, server.client_id)
+    except Exception:
+        pass
+
+
 class TASmartLLM:
     """
     ComfyUI node for LLM prompt generation via LM Studio or Ollama.
@@ -78,70 +515,23 @@ class TASmartLLM:
     - Status feedback for workflow debugging
     """
 
-    @classmethod
-    def _load_cached_models(cls):
-        try:
-            with open(CACHE_FILE, "r") as f:
-                return set(json.load(f))
-        except:
-            return set()
-
-    @classmethod
-    def _save_cached_models(cls, models):
-        try:
-            with open(CACHE_FILE, "w") as f:
-                json.dump(sorted(models), f)
-        except:
-            pass
-
     @classmethod
     def get_models(cls):
         """
-        Discovers and caches available models from LM Studio (port 1234) and
-        Ollama (port 11434). Tags vision-capable models with [Vision] suffix.
+        Returns the available models of all backends configured in
+        ta_smart_llm_backends.json as "<backend>/<model>", vision-capable
+        ones tagged with [Vision] suffix.
 
         Display logic:
         - All known models are always shown (prevents validation errors).
         - Active models appear at the top of the list, offline models below.
         - No prefix is added to model names so stored values remain stable
           across restarts regardless of which backend is active.
-        - Per-backend cache is updated on each call if the backend responds,
-          so added/removed models are reflected immediately.
+        - The list comes from MODEL_REGISTRY and is refreshed in the background
+          every MODEL_REFRESH_SECONDS, so added/removed models show up on the
+          next UI refresh without blocking INPUT_TYPES.
         """
-        known = cls._load_cached_models()
-
-        known_lmstudio = {m for m in known if m.startswith("LMStudio/")}
-        known_ollama   = {m for m in known if m.startswith("Ollama/")}
-
-        active_lmstudio = set()
-        active_ollama   = set()
-
-        # Query LM Studio — replace cache if reachable
-        try:
-            r = requests.get("http://127.0.0.1:1234/v1/models", timeout=0.5)
-            if r.status_code == 200:
-                known_lmstudio = {f"LMStudio/{m['id']}" for m in r.json()['data']}
-                active_lmstudio = known_lmstudio
-        except:
-            pass
-
-        # Query Ollama — replace cache if reachable
-        try:
-            r = requests.get("http://127.0.0.1:11434/api/tags", timeout=0.5)
-            if r.status_code == 200:
-                known_ollama = {f"Ollama/{m['name']}" for m in r.json()['models']}
-                active_ollama = known_ollama
-        except:
-            pass
-
-        cls._save_cached_models(known_lmstudio | known_ollama)
-
-        active  = sorted(active_lmstudio | active_ollama)
-        offline = sorted((known_lmstudio | known_ollama) - (active_lmstudio | active_ollama))
-
-        # Active models first, offline models after — no prefix in stored value
-        result = [tag_model(m) for m in active] + [tag_model(m) for m in offline]
-        return result if result else ["No Backend"]
+        return MODEL_REGISTRY.models()
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -154,10 +544,13 @@ class TASmartLLM:
         user_prompt: Main user input prompt (multiline).
         system_prompt: System instruction for the LLM.
         unload_image_models_first: Unload ComfyUI image models before inference.
-        unload_llm_after: Unload LLM model from backend after generation.
+        unload_llm_after: Unload LLM model from backend once it has been idle for llm_idle_timeout.
 
         Optional Inputs:
         image: IMAGE tensor for vision models (auto-detected).
+        response_cache: Reuse answers of identical requests ('off', 'memory', 'memory + disk').
+        stream_output: Stream the answer and show it live on the node.
+        llm_idle_timeout: Seconds the LLM stays loaded after the last request (with unload_llm_after).
 
         Returns:
         dict: ComfyUI INPUT_TYPES dictionary.
@@ -177,13 +570,35 @@ class TASmartLLM:
                 "unload_llm_after": ("BOOLEAN", {"default": True}),
             },
             "optional": {
-                "image": ("IMAGE",)
+                "image": ("IMAGE",),
+                "response_cache": (RESPONSE_CACHE_MODES, {
+                    "default": "off",
+                    "tooltip": "Reuse the answer of an identical request (model, prompts, temperature, "
+                               "max_tokens, thinking mode, image) instead of calling the LLM again. "
+                               "'memory + disk' keeps answers across restarts."
+                }),
+                "stream_output": ("BOOLEAN", {
+                    "default": True,
+                    "label_on": "Streaming",
+                    "label_off": "Blocking",
+                    "tooltip": "Stream the answer and show text, reasoning and token count live on the node. "
+                               "Cancel stops the backend immediately."
+                }),
+                "llm_idle_timeout": ("INT", {
+                    "default": 300, "min": 0, "max": 86400, "step": 30,
+                    "tooltip": "With unload_llm_after: keep the LLM loaded this many seconds after the last "
+                               "request, so queued prompts reuse the warm model. It is unloaded earlier if "
+                               "ComfyUI needs the VRAM. 0 = unload right after each request."
+                }),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
             }
         }
 
     RETURN_TYPES = ("STRING", "STRING", "STRING")
     RETURN_NAMES = ("prompt", "status", "reasoning")
-    FUNCTION = "generate"
+    FUNCTION = "generate" if ASYNC_NODES else "generate_blocking"
     CATEGORY = "TA Tools"
 
     @classmethod
@@ -191,21 +606,29 @@ class TASmartLLM:
                    temperature=0.7, max_tokens=1024, request_timeout=120,
                    thinking_mode=False,
                    unload_image_models_first=False, unload_llm_after=False,
-                   image=None):
+                   image=None, response_cache="off", stream_output=True, llm_idle_timeout=300,
+                   unique_id=None):
+        # ComfyUI übergibt verlinkte Inputs (meist user_prompt, immer image) hier als None.
+        # Deren Änderungen lösen über den Upstream-Cache ohnehin eine neue Ausführung aus,
+        # daher werden nur die Widget-Werte gehasht; der Bild-Hash steckt im ResponseCache-Key.
         # Wenn deaktiviert: fixer Wert → Node wird von ComfyUI gecacht, kein erneuter Aufruf
-        if not llm_enable:
+        if llm_enable is not None and not llm_enable:
             return "disabled"
+        # Mit Response-Cache: Hash der Anfrage → unveränderte Anfragen werden von ComfyUI gecacht
+        if response_cache != "off":
+            return response_key(model or "", user_prompt or "", system_prompt or "",
+                                temperature, max_tokens, thinking_mode)
         return time.time()
 
-    def _backend_reachable(self, backend, port):
+    async def _reachable_endpoints(self, session, backend, model_name):
         """
-        Checks if LM Studio or Ollama backend is responding.
+        Returns the servers of backend that serve model_name and are
+        responding right now. All candidates are probed concurrently.
         """
-        try:
-            url = f"http://127.0.0.1:{port}/v1/models" if "LMStudio" in backend else f"http://127.0.0.1:{port}/api/tags"
-            return requests.get(url, timeout=0.5).status_code == 200
-        except:
-            return False
+        candidates = MODEL_REGISTRY.endpoints_for(backend, model_name)
+        alive = await asyncio.gather(*(llm_client.aget_ok(session, backend.models_url(e), timeout=0.5)
+                                       for e in candidates))
+        return [e for e, ok in zip(candidates, alive) if ok]
 
     def _unload_comfyui_models(self):
         """
@@ -218,29 +641,6 @@ class TASmartLLM:
         except Exception as e:
             print(f"[TA Smart LLM] Warning: Could not unload image models: {e}")
 
-    def _unload_lmstudio_llm(self):
-        """
-        Unloads the active LM Studio model via lms CLI tool.
-        """
-        try:
-            subprocess.run(["lms", "unload", "--all"], timeout=15, capture_output=True)
-            print(f"[TA Smart LLM] LM Studio model unloaded successfully.")
-        except Exception as e:
-            print(f"[TA Smart LLM] Warning: Could not unload LM Studio model: {e}")
-
-    def _unload_ollama_llm(self, model_name):
-        """
-        Unloads an Ollama model by calling it with keep_alive=0.
-        """
-        try:
-            requests.post("http://127.0.0.1:11434/api/generate", json={
-                "model": model_name,
-                "keep_alive": 0
-            }, timeout=10)
-            print(f"[TA Smart LLM] Ollama model unloaded successfully: {model_name}")
-        except Exception as e:
-            print(f"[TA Smart LLM] Warning: Could not unload Ollama model: {e}")
-
     def _build_image_b64(self, image):
         """
         Converts IMAGE tensor to base64 PNG for vision model input.
@@ -251,48 +651,151 @@ class TASmartLLM:
         img.save(buffer, 'PNG')
         return base64.b64encode(buffer.getvalue()).decode('utf-8')
 
-    def _post_with_retry(self, url, payload, is_lmstudio, max_retries=3, retry_delay=1.5, timeout=120):
+    async def _stream_answer(self, session, url, payload, is_lmstudio, timeout, on_update=None,
+                             stats=None):
+        """
+        Streams one answer and returns it in the shape of the non-streaming API
+        response, so _post_with_retry() extracts it the same way.
+
+        on_update(text, reasoning, tokens, done) is called at most every
+        STREAM_UPDATE_SECONDS and once at the end. Every chunk checks for a
+        ComfyUI interrupt; leaving the loop closes the connection. If stats
+        is given it receives first_chunk_s, the time to the first chunk.
+        """
+        content, reasoning = [], []
+        tokens   = 0
+        notified = 0.0
+        started  = time.perf_counter()
+        stream_format = "sse" if is_lmstudio else "ndjson"
+        async for chunk in llm_client.apost_stream(session, url, {**payload, "stream": True},
+                                                   timeout, stream_format):
+            _check_interrupt()
+            if stats is not None and "first_chunk_s" not in stats:
+                stats["first_chunk_s"] = time.perf_counter() - started
+            if is_lmstudio:
+                choices = chunk.get("choices") or []
+                delta   = choices[0].get("delta") or {} if choices else {}
+                piece   = delta.get("content") or ""
+                thought = delta.get("reasoning_content") or delta.get("reasoning") or ""
+            else:
+                piece   = chunk.get("response") or ""
+                thought = chunk.get("thinking") or ""
+            if not piece and not thought:
+                continue
+            tokens += 1
+            content.append(piece)
+            reasoning.append(thought)
+            if on_update is not None and time.perf_counter() - notified >= STREAM_UPDATE_SECONDS:
+                notified = time.perf_counter()
+                on_update("".join(content), "".join(reasoning), tokens, False)
+
+        text, thoughts = "".join(content), "".join(reasoning)
+        if on_update is not None:
+            on_update(text, thoughts, tokens, True)
+        if is_lmstudio:
+            return {"choices": [{"message": {"content": text, "reasoning_content": thoughts}}]}
+        return {"response": text}
+
+    async def _post_with_retry(self, session, backend, endpoints, payload, max_retries=3, retry_delay=1.5,
+                               timeout=120, stream=False, on_update=None):
         """
         Posts to LLM API with retry logic for transient errors.
-        For LM Studio returns the full message dict; for Ollama returns the response string.
+        For LM Studio returns the full message dict; for Ollama returns the
+        response string, each together with the Endpoint that answered.
+        With stream the answer is received via _stream_answer(); a stream that
+        breaks off is retried from the start.
+
+        endpoints are the reachable replicas of backend. They form an
+        EndpointPool for this request: a failed attempt fails over to a
+        replica not tried yet without waiting, and the outcome feeds the
+        replica's health, so servers that keep failing are skipped by later
+        requests until their cooldown ends. Once every replica was tried the
+        usual backoff applies; there are at least as many attempts as replicas.
+
+        Requests to the same server share one AIMD controller (see
+        llm_client.get_controller()), so parallel workflows back off together
+        when the server reports overload. Its latency signal is the time to
+        the first streamed chunk; the full generation time depends on
+        max_tokens and answer length rather than server load, so blocking
+        requests only report success or failure. Retries wait a jittered exponential
+        delay of up to retry_delay, 2 * retry_delay, ... and honour Retry-After.
+
+        Waiting for a slot, the request itself and the backoff are all
+        cancelled as soon as ComfyUI reports an interrupt.
         """
-        last_error = None
-        for attempt in range(1, max_retries + 1):
+        is_lmstudio = backend.is_lmstudio
+        pool        = llm_client.EndpointPool(endpoints)
+        attempts    = max(max_retries, len(pool))
+        tried       = []
+        for attempt in range(1, attempts + 1):
+            endpoint   = pool.acquire(exclude=tried)
+            url        = backend.request_url(endpoint)
+            controller = llm_client.get_controller(url)
             try:
-                r = requests.post(url, json=payload, timeout=timeout)
-                r.raise_for_status()
-                if is_lmstudio:
-                    return r.json()['choices'][0]['message']  # Return full message dict
-                else:
-                    return r.json()['response']
-            except requests.exceptions.HTTPError as e:
-                last_error = e
-                if e.response is not None and e.response.status_code in (400, 500, 502, 503) and attempt < max_retries:
-                    time.sleep(retry_delay)
-                    continue
+                await controller.acquire_async(_check_interrupt)
+            except BaseException:
+                pool.release(endpoint, ok=True)
                 raise
-            except requests.exceptions.RequestException as e:
-                last_error = e
-                if attempt < max_retries:
-                    time.sleep(retry_delay)
+            started = time.perf_counter()
+            stats   = {}
+            try:
+                if stream:
+                    request = self._stream_answer(session, url, payload, is_lmstudio, timeout, on_update,
+                                                  stats)
+                else:
+                    request = llm_client.apost_json(session, url, payload, timeout)
+                data = await llm_client.run_cancellable(request, _check_interrupt)
+            except llm_client.LLMRequestError as e:
+                elapsed = time.perf_counter() - started
+                controller.release(elapsed, ok=False, status_code=e.status_code)
+                pool.release(endpoint, ok=False, latency=elapsed, status_code=e.status_code)
+                retryable = e.status_code is None or e.status_code in (400, 429, 500, 502, 503, 504)
+                if not retryable or attempt >= attempts:
+                    raise
+                if endpoint not in tried:
+                    tried.append(endpoint)
+                if len(tried) < len(pool):
+                    print(f"[TA Smart LLM] {endpoint.name} failed ({e}) – failing over to another server.")
                     continue
+                delay = llm_client.backoff_delay(attempt - 1, base=retry_delay, retry_after=e.retry_after)
+                await llm_client.run_cancellable(asyncio.sleep(delay), _check_interrupt)
+                continue
+            except BaseException:
+                controller.release(ok=False, status_code=0)  # Interrupted – not a server signal
+                pool.release(endpoint, ok=True)
                 raise
-        raise last_error
+            latency = stats.get("first_chunk_s")  # None without streaming: no latency signal
+            controller.release(latency, ok=True)
+            pool.release(endpoint, ok=True, latency=latency)
+            if is_lmstudio:
+                return data['choices'][0]['message'], endpoint  # Return full message dict
+            else:
+                return data['response'], endpoint
 
-    def generate(self, llm_enable, model, user_prompt, system_prompt,
-                 temperature=0.7, max_tokens=1024, request_timeout=120,
-                 thinking_mode=False,
-                 unload_image_models_first=False, unload_llm_after=False,
-                 image=None):
+    def generate_blocking(self, **kwargs):
+        """
+        Entry point for ComfyUI versions without async nodes: runs generate()
+        on a private event loop in the execution thread.
+        """
+        return asyncio.run(self.generate(**kwargs))
+
+    async def generate(self, llm_enable, model, user_prompt, system_prompt,
+                       temperature=0.7, max_tokens=1024, request_timeout=120,
+                       thinking_mode=False,
+                       unload_image_models_first=False, unload_llm_after=False,
+                       image=None, response_cache="off", stream_output=True, llm_idle_timeout=300,
+                       unique_id=None):
         """
         Main generation method. Queries the selected LLM and returns prompt + status.
 
         Workflow:
-        1. Skip if disabled or backend unreachable.
+        1. Skip if disabled; answer from the response cache on a hit; skip if
+           the backend is unreachable.
         2. Optionally unload ComfyUI models for VRAM.
         3. Build payload (text + optional image b64).
         4. Send request to LM Studio/Ollama with retries.
-        5. Optionally unload LLM model after.
+        5. Optionally hand the LLM to the ResidencyManager, which unloads it
+           after llm_idle_timeout seconds without requests.
         
         Args:
         llm_enable (bool): Master enable toggle.
@@ -300,8 +803,13 @@ class TASmartLLM:
         user_prompt (str): User input.
         system_prompt (str): System instruction.
         unload_image_models_first (bool): Free VRAM before.
-        unload_llm_after (bool): Free VRAM after.
+        unload_llm_after (bool): Free VRAM once the LLM has been idle for llm_idle_timeout.
         image: Optional IMAGE for vision models.
+        response_cache (str): 'off', 'memory' or 'memory + disk'. Only
+            successful answers are cached.
+        stream_output (bool): Stream the answer and push it to the node.
+        llm_idle_timeout (int): Idle seconds before the LLM is unloaded.
+        unique_id: Node id (hidden input) for the stream updates.
 
         Returns:
         tuple: (generated_prompt: str, status: str, reasoning: str)
@@ -309,13 +817,40 @@ class TASmartLLM:
         if not llm_enable:
             return ("", "DISABLED", "")
 
+        key  = None
+        disk = response_cache == "memory + disk"
+        if response_cache in RESPONSE_CACHE_MODES[1:]:
+            key    = response_key(model, user_prompt, system_prompt, temperature, max_tokens,
+                                  thinking_mode, image)
+            cached = RESPONSE_CACHE.get(key, disk=disk)
+            if cached is not None:
+                print(f"[TA Smart LLM] Response cache hit ({key[:12]}) – skipping LLM request.")
+                prompt, status, reasoning = cached
+                return (prompt, f"{status} (cached)", reasoning)
+
+        async with llm_client.async_session() as session:
+            result = await self._generate(session, model, user_prompt, system_prompt,
+                                          temperature, max_tokens, request_timeout, thinking_mode,
+                                          unload_image_models_first, unload_llm_after, image,
+                                          stream_output, llm_idle_timeout, unique_id)
+        if key is not None and result[1].endswith("✅"):
+            RESPONSE_CACHE.put(key, result, disk=disk)
+        return result
+
+    async def _generate(self, session, model, user_prompt, system_prompt,
+                        temperature, max_tokens, request_timeout, thinking_mode,
+                        unload_image_models_first, unload_llm_after, image,
+                        stream_output=False, llm_idle_timeout=300, unique_id=None):
+
         clean_model = strip_vision_tag(model)
-        backend = clean_model.split('/')[0]
-        model_name = '/'.join(clean_model.split('/')[1:])
-        port = 1234 if "LMStudio" in backend else 11434
+        backend_name, _, model_name = clean_model.partition('/')
+        backend = MODEL_REGISTRY.backend(backend_name)
+        if backend is None:
+            return ("", f"SKIPPED - {backend_name} not configured in {os.path.basename(BACKENDS_FILE)}", "")
 
-        if not self._backend_reachable(backend, port):
-            return ("", f"SKIPPED - {backend} not reachable", "")
+        endpoints = await self._reachable_endpoints(session, backend, model_name)
+        if not endpoints:
+            return ("", f"SKIPPED - {backend_name} not reachable", "")
 
         print(f"[TA Smart LLM] Loading model: {clean_model}")
 
@@ -327,85 +862,97 @@ class TASmartLLM:
 
         img_b64 = self._build_image_b64(image) if image is not None else None
 
+        def on_update(text, reasoning, tokens, done):
+            _send_stream_update(unique_id, text, reasoning, tokens, done)
+        stream = {"stream": bool(stream_output), "on_update": on_update}
+
+        # With unload_llm_after the reachable replicas count as in use during the
+        # request; afterwards the answering one starts its idle window.
+        held = [(backend.type, e.url, model_name) for e in endpoints] if unload_llm_after else []
+        hint = keep_alive_hint(backend.type, llm_idle_timeout) if unload_llm_after else {}
+        endpoint = None
+        RESIDENCY.hold(held)
         try:
-            if "LMStudio" in backend:
-                url = f"http://127.0.0.1:{port}/v1/chat/completions"
-                if img_b64:
-                    user_content = [
-                        {"type": "text", "text": full_prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}}
-                    ]
-                else:
-                    user_content = full_prompt
-                payload = {
-                    "model": model_name,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_content}
-                    ],
-                    "temperature": temperature,
-                    "max_tokens": max_tokens
-                }
-
-                message = self._post_with_retry(url, payload, is_lmstudio=True, timeout=request_timeout)
-
-                content   = (message.get('content') or '').strip()
-                reasoning = (message.get('reasoning_content') or '').strip()
-
-                if thinking_mode:
-                    # Thinking ON → return full content including thinking
-                    result = content if content else reasoning
-                else:
-                    # Thinking OFF → return only the final answer, strip thinking
-                    if content:
-                        if "</think>" in content:
-                            result = content.split("</think>", 1)[-1].strip()
-                        else:
-                            result = content
+            try:
+                if backend.is_lmstudio:
+                    if img_b64:
+                        user_content = [
+                            {"type": "text", "text": full_prompt},
+                            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}}
+                        ]
                     else:
-                        if "</think>" in reasoning:
-                            result = reasoning.split("</think>", 1)[-1].strip()
-                        else:
-                            result = ""  # Pure thinking block, no answer
-
-                # Unload LM Studio model after request
-                if unload_llm_after:
-                    self._unload_lmstudio_llm()
-
-            else:  # Ollama
-                url = f"http://127.0.0.1:{port}/api/generate"
-                payload = {
-                    "model": model_name,
-                    "prompt": f"{system_prompt}\n\n{full_prompt}".strip(),
-                    "stream": False,
-                    "options": {
+                        user_content = full_prompt
+                    payload = {
+                        "model": model_name,
+                        "messages": [
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": user_content}
+                        ],
                         "temperature": temperature,
-                        "num_predict": max_tokens
+                        "max_tokens": max_tokens,
+                        **hint
                     }
-                }
 
-                if img_b64:
-                    payload["images"] = [img_b64]
-                result = self._post_with_retry(url, payload, is_lmstudio=False, timeout=request_timeout)
-                reasoning = ""
+                    message, endpoint = await self._post_with_retry(session, backend, endpoints, payload,
+                                                                    timeout=request_timeout, **stream)
 
-                # Ollama: strip <think> tags if thinking is OFF
-                if not thinking_mode and "</think>" in result:
-                    reasoning = result.split("</think>", 1)[0].replace("<think>", "").strip()
-                    result = result.split("</think>", 1)[-1].strip()
+                    content   = (message.get('content') or '').strip()
+                    reasoning = (message.get('reasoning_content') or '').strip()
 
-                # Unload Ollama model after request
-                if unload_llm_after:
-                    self._unload_ollama_llm(model_name)
+                    if thinking_mode:
+                        # Thinking ON → return full content including thinking
+                        result = content if content else reasoning
+                    else:
+                        # Thinking OFF → return only the final answer, strip thinking
+                        if content:
+                            if "</think>" in content:
+                                result = content.split("</think>", 1)[-1].strip()
+                            else:
+                                result = content
+                        else:
+                            if "</think>" in reasoning:
+                                result = reasoning.split("</think>", 1)[-1].strip()
+                            else:
+                                result = ""  # Pure thinking block, no answer
+
+                else:  # Ollama
+                    payload = {
+                        "model": model_name,
+                        "prompt": f"{system_prompt}\n\n{full_prompt}".strip(),
+                        "stream": False,
+                        "options": {
+                            "temperature": temperature,
+                            "num_predict": max_tokens
+                        },
+                        **hint
+                    }
 
-            if result.strip():
-                return (result.strip(), f"{clean_model} ✅", reasoning)
-            else:
-                return ("", f"WARNING: {clean_model} returned empty response", reasoning)
+                    if img_b64:
+                        payload["images"] = [img_b64]
+                    result, endpoint = await self._post_with_retry(session, backend, endpoints, payload,
+                                                                   timeout=request_timeout, **stream)
+                    reasoning = ""
+
+                    # Ollama: strip <think> tags if thinking is OFF
+                    if not thinking_mode and "</think>" in result:
+                        reasoning = result.split("</think>", 1)[0].replace("<think>", "").strip()
+                        result = result.split("</think>", 1)[-1].strip()
+                # Name the answering server when the backend has replicas
+                source = f"{clean_model} @ {endpoint.name}" if len(backend.endpoints) > 1 else clean_model
+                if result.strip():
+                    return (result.strip(), f"{source} ✅", reasoning)
+                else:
+                    return ("", f"WARNING: {clean_model} returned empty response", reasoning)
 
-        except Exception as e:
-            return (f"ERROR: {str(e)}", clean_model, "")
+            except Exception as e:
+                if _is_interrupt(e):
+                    raise
+                return (f"ERROR: {str(e)}", clean_model, "")
+        finally:
+            if held:
+                used = (backend.type, endpoint.url, model_name) if endpoint is not None else None
+                await asyncio.to_thread(RESIDENCY.release, held, used, llm_idle_timeout)
 
 
 NODE_CLASS_MAPPINGS = {"TASmartLLM": TASmartLLM}
-NODE_DISPLAY_NAME_MAPPINGS = {"TASmartLLM": "TA Smart LLM v3.8"}
+NODE_DISPLAY_NAME_MAPPINGS = {"TASmartLLM": "TA Smart LLM v4.0"}
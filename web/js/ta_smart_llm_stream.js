@@ -0,0 +1,45 @@
+/**
+ * TASmartLLMStream - Frontend Extension
+ * Shows the streamed answer of TA Smart LLM live on the node.
+ * The backend sends "ta_smart_llm.stream" events with the partial text,
+ * reasoning and token count (see _send_stream_update in ta_smart_llm.py).
+ *
+ * Part of the TA Nodes Pack by thomo.ART
+ */
+
+import { app } from "../../scripts/app.js";
+import { api } from "../../scripts/api.js";
+import { ComfyWidgets } from "../../scripts/widgets.js";
+
+const EVENT_NAME  = "ta_smart_llm.stream";
+const WIDGET_NAME = "llm_stream";
+
+function getStreamWidget(node) {
+    let widget = node.widgets?.find(w => w.name === WIDGET_NAME);
+    if (widget) return widget;
+
+    widget = ComfyWidgets["STRING"](node, WIDGET_NAME, ["STRING", { multiline: true }], app).widget;
+    widget.inputEl.readOnly      = true;
+    widget.inputEl.style.opacity = 0.8;
+    widget.serialize             = false;  // Not part of the workflow / prompt
+    node.setSize([node.size[0], Math.max(node.size[1], node.computeSize()[1])]);
+    return widget;
+}
+
+app.registerExtension({
+    name: "thomo.TASmartLLMStream",
+
+    setup() {
+        api.addEventListener(EVENT_NAME, ({ detail }) => {
+            const node = app.graph.getNodeById(Number(detail.node) || detail.node);
+            if (!node) return;
+
+            const widget = getStreamWidget(node);
+            const state  = detail.done ? "done" : "…";
+            const body   = detail.text || (detail.reasoning ? `💭 ${detail.reasoning}` : "");
+            widget.value = `[${detail.tokens} tokens ${state}]\n${body}`;
+            widget.inputEl.scrollTop = widget.inputEl.scrollHeight;
+            app.graph.setDirtyCanvas(true, false);
+        });
+    },
+});